@@ -1,14 +1,31 @@
-from hashlib import new
+import os
+import csv
 import sys
 import re
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
 from datetime import date
 
-import pandas as pd
+import runstats
+import runstore
 
 PATH = '/home/geodev/data/code/misc/data/runlog'
+PATH_STORE = PATH + '.cols'
 PATH_GEAR = '/home/geodev/data/code/misc/data/gear_mileage.csv'
 TODAY = date.today()
 
+GEAR_COLUMNS = {'kb': 'kinvara_blue',
+                'kw': 'kinvara_white',
+                'p': 'peregrine',
+                't': 'trek_shoes',
+                'b': 'bike'
+                }
+RUNLOG_GEAR = ['kw', 'kb', 'p']
+PATTERN_FULL = re.compile(r'\d{4}-\d{2}-\d{2},\d{2}:\d{2}:\d{2},\d{1,3}\.\d{1,2},(kw|kb|p)?')
+PATTERN_TODAY = re.compile(                 r'\d{2}:\d{2}:\d{2},\d{1,3}\.\d{1,2},(kw|kb|p)?')
+
 def test_newrun(newrun):
     """Check the inputs of a run
     Args:
@@ -17,69 +34,261 @@ def test_newrun(newrun):
         gear type is one of {'kw', 'kb, 'p'}
         for linvara_white, kinvara_blue or peregrine
     """
-    pattern_full = r'\d{4}-\d{2}-\d{2},\d{2}:\d{2}:\d{2},\d{1,3}\.\d{1,2},(kw|kb|p)?'
-    pattern_today =                  r'\d{2}:\d{2}:\d{2},\d{1,3}\.\d{1,2},(kw|kb|p)?'
-    if re.fullmatch(pattern_full, newrun):
-        return re.fullmatch(pattern_full, newrun).group()
+    match = PATTERN_FULL.fullmatch(newrun)
+    if match:
+        return match.group()
     else:
-        return f'{TODAY},{re.fullmatch(pattern_today, newrun).group()}'
+        return f'{TODAY},{PATTERN_TODAY.fullmatch(newrun).group()}'
+
 
-def read_runlog(PATH, newrun):
+def gear_ledger(PATH_GEAR):
+    """Return the path of the append-only mileage delta log kept next to PATH_GEAR"""
+    return PATH_GEAR + '.log'
+
+
+def read_runs(lines):
+    """Validate a whole stream of runs before anything is written
+    Args:
+        lines: iterable of runs, one per line, in any form accepted by `test_newrun`
+    Returns:
+        list of runs in form `'YYYY-MM-DD,HH:MM:SS,KK.MM,[kw,kb,p]'`
+    Raises:
+        ValueError listing every invalid line, in which case nothing is added
     """
-    Add a run to PATH file
+    newruns, errors = [], []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            newruns.append(test_newrun(line))
+        except AttributeError:
+            errors.append(f'line {lineno}: {line!r}')
+    if errors:
+        raise ValueError('Invalid runs, nothing was added:\n' + '\n'.join(errors))
+    return newruns
+
+
+def update_gear_mileages(PATH_GEAR, deltas):
+    """Add summed mileage to several pieces of gear with a single append to the gear ledger.
     Args:
-        PATH: absolute or relative path to file, [str]
-        newrun: run details in form `'YYYY-MM-DD,HH:MM:SS,KK.MM'`
+        PATH_GEAR: absolute or relative path to file, [str]
+        deltas: dict of gear type to kms to add
     """
-    timedate = ' '.join(newrun.split(',')[:2])
-    distance = newrun.split(',')[2]
-    newrun = ','.join([timedate, distance])
-    with open(PATH, 'a') as f:
-        newrun += '\n'
-        f.write(newrun)
+    with open(gear_ledger(PATH_GEAR), 'a') as f:
+        f.write(''.join(f'{GEAR_COLUMNS[gear]},{kms}\n' for gear, kms in deltas.items()))
 
-    print(f'Run: "{newrun}" added to runlog.')
-    return
+    for gear, kms in deltas.items():
+        print(f'{GEAR_COLUMNS[gear]} mileage increased by {kms:.2f}km')
+    return None
 
 
-def update_gear_mileage(PATH_GEAR, newrun):
-    """Upate mileage for a given piece of gear.
+def read_gear_mileage(PATH_GEAR):
+    """Current mileage: the gear file plus every delta in the gear ledger.
     Args:
-        PATH: absolute or relative path to file, [str]
-        newrun: run details in form `'YYYY-MM-DD,HH:MM:SS,KK.MM,[kw,kb,p,t,b]'`
+        PATH_GEAR: absolute or relative path to file, [str]
+    Returns:
+        dict of gear column name to km, in gear file column order
+    """
+    with open(PATH_GEAR, newline='') as f:
+        mileage = {col: float(km) for col, km in next(csv.DictReader(f)).items()}
+    try:
+        with open(gear_ledger(PATH_GEAR)) as f:
+            for line in f:
+                col, kms = line.rstrip('\n').split(',')
+                mileage[col] = mileage.get(col, 0.) + float(kms)
+    except FileNotFoundError:
+        pass
+    return {col: round(km, 2) for col, km in mileage.items()}
+
+
+def compact_gear_ledger(PATH, PATH_GEAR, PATH_STORE=None):
+    """Fold the gear ledger into the gear file and empty the ledger.
+    Args:
+        PATH: absolute or relative path to runlog file, [str]
+        PATH_GEAR: absolute or relative path to gear file, [str]
+        PATH_STORE: optional `runstore` directory written by `ingest`
+    Returns:
+        dict of gear column name to km
     Notes:
-        gear type is one of {'kw', 'kb', 'p', 't', 'b'}
-        kw and kb are the main road running shoes when either there is an overlap
-        between an old and new pair, or if there are two pairs to prepare for a
-        long race.
-        for road, trail, trek or bike
+        the new gear file is written next to PATH_GEAR and swapped in with
+        `os.replace` so readers only ever see the old or the new mileage.
+        the locks are taken in the same order as `ingest`, and a batch left in
+        the journal by a crashed writer is finished first, otherwise it would
+        be folded in now and applied again by the next `ingest`
     """
-    colnames = {'kb': 'kinvara_blue',
-                'kw': 'kinvara_white',
-                'p': 'peregrine',
-                't': 'trek_shoes',
-                'b': 'bike'
-                }
-    gear = newrun.split(',')[-1]
-    kms = float(newrun.split(',')[-2])
-    df = pd.read_csv(PATH_GEAR)
-    df.loc[0, colnames.get(gear)] += kms
-    df.loc[0, colnames.get(gear)] = df.loc[0, colnames.get(gear)].round(2)
-    df.to_csv(PATH_GEAR, index=False)
-
-    print(f'{colnames.get(gear)} mileage increased by {kms}km')
-    return None
+    with locked(PATH), locked(PATH_GEAR):
+        _recover(PATH, PATH_GEAR, PATH_STORE)
+        mileage = read_gear_mileage(PATH_GEAR)
+        tmp = PATH_GEAR + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(mileage))
+            writer.writeheader()
+            writer.writerow(mileage)
+        os.replace(tmp, PATH_GEAR)
+        try:
+            os.remove(gear_ledger(PATH_GEAR))
+        except FileNotFoundError:
+            pass
+    return mileage
+
+
+def add_runs(PATH, PATH_GEAR, newruns, PATH_STORE=None):
+    """Bulk import: append all runs in one write and update the gear file once.
+    Args:
+        PATH: absolute or relative path to runlog file, [str]
+        PATH_GEAR: absolute or relative path to gear file, [str]
+        newruns: validated runs from `read_runs`
+        PATH_STORE: optional `runstore` directory to append to as well
+    Returns:
+        number of runs added to the runlog
+    """
+    store_rows, deltas = [], {}
+    for newrun in newruns:
+        fields = newrun.split(',')
+        gear = fields[-1]
+        if gear in RUNLOG_GEAR:
+            store_rows.append((' '.join(fields[:2]), fields[2], gear))
+        if gear in GEAR_COLUMNS:
+            deltas[gear] = deltas.get(gear, 0) + float(fields[-2])
+
+    rows = [(timedate, distance) for timedate, distance, _ in store_rows]
+    with open(PATH, 'a') as f:
+        f.write(''.join(f'{timedate},{distance}\n' for timedate, distance in rows))
+    runstats.append_runs(PATH, rows)
+    if PATH_STORE is not None and os.path.isdir(PATH_STORE):
+        runstore.append_runs(PATH_STORE, store_rows)
+    if deltas:
+        update_gear_mileages(PATH_GEAR, deltas)
+
+    print(f'{len(rows)} runs added to runlog.')
+    return len(rows)
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on `path + '.lock'` for the duration of the block"""
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def run_id(newrun):
+    """Stable id of a run, the same run synced from two devices gets the same id
+    Args:
+        newrun: run in form `'YYYY-MM-DD,HH:MM:SS,KK.MM,[gear]'`
+    """
+    day, time, kms, *gear = newrun.split(',')
+    canonical = f'{day},{time},{float(kms):.2f},{"".join(gear)}'
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+def _ingest_files(PATH, PATH_GEAR, PATH_STORE):
+    """Every append-only file touched by `ingest`, with the run ids file last"""
+    paths = [PATH, gear_ledger(PATH_GEAR)]
+    if PATH_STORE is not None and os.path.isdir(PATH_STORE):
+        paths += runstore.column_paths(PATH_STORE)
+    return paths + [PATH + '.ids']
+
+
+def _fsync_append(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _apply(PATH, PATH_GEAR, PATH_STORE, record):
+    """Apply a journal record: append its runs, then commit its run ids"""
+    add_runs(PATH, PATH_GEAR, record['runs'], PATH_STORE)
+    _fsync_append(PATH + '.ids', ''.join(f'{i}\n' for i in record['ids']))
+
+
+def _recover(PATH, PATH_GEAR, PATH_STORE):
+    """Finish the batch of a writer that died between journaling and committing it.
+    All target files are append-only, so they are cut back to the sizes recorded
+    in the journal and the batch is applied again from scratch.
+    """
+    journal = PATH + '.journal'
+    try:
+        with open(journal) as f:
+            record = json.loads(f.read() or 'null')
+    except FileNotFoundError:
+        return
+    if record is not None:
+        for path, size in record['sizes'].items():
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        print(f'Recovering {len(record["runs"])} runs from an interrupted import.')
+        _apply(PATH, PATH_GEAR, PATH_STORE, record)
+    os.remove(journal)
+
+
+def ingest(PATH, PATH_GEAR, newruns, PATH_STORE=None):
+    """Add runs safely when several addrun processes write at once.
+    Runs already in the log (same `run_id`) are skipped so repeated device
+    syncs never double count. The batch is written to a journal before it is
+    applied, and a crashed batch is finished by the next writer.
+    Args:
+        PATH: absolute or relative path to runlog file, [str]
+        PATH_GEAR: absolute or relative path to gear file, [str]
+        newruns: validated runs from `test_newrun` or `read_runs`
+        PATH_STORE: optional `runstore` directory to append to as well
+    Returns:
+        number of new runs
+    """
+    with locked(PATH), locked(PATH_GEAR):
+        _recover(PATH, PATH_GEAR, PATH_STORE)
+        try:
+            with open(PATH + '.ids') as f:
+                seen = set(f.read().split())
+        except FileNotFoundError:
+            seen = set()
+        runs, ids = [], []
+        for newrun in newruns:
+            i = run_id(newrun)
+            if i not in seen:
+                seen.add(i)
+                runs.append(newrun)
+                ids.append(i)
+        if not runs:
+            print('No new runs.')
+            return 0
+
+        sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0
+                 for path in _ingest_files(PATH, PATH_GEAR, PATH_STORE)}
+        record = {'sizes': sizes, 'runs': runs, 'ids': ids}
+        journal = PATH + '.journal'
+        with open(journal, 'w') as f:
+            json.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+        _apply(PATH, PATH_GEAR, PATH_STORE, record)
+        os.remove(journal)
+    return len(runs)
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['--compact']:
+        for col, km in compact_gear_ledger(PATH, PATH_GEAR, PATH_STORE).items():
+            print(f'{col}: {km}km')
+        sys.exit()
+    if sys.argv[1:2] == ['--bulk']:
+        # `addrun.py --bulk runs.txt`, or `-` to read the runs from stdin
+        with (sys.stdin if sys.argv[2] == '-' else open(sys.argv[2])) as f:
+            newruns = read_runs(f)
+        ingest(PATH, PATH_GEAR, newruns, PATH_STORE)
+        sys.exit()
     try:
-        newrun = test_newrun(sys.argv[1])
-        if newrun.split(',')[-1] in ['kw', 'kb', 'p']:
-            read_runlog(PATH, newrun)
-        update_gear_mileage(PATH_GEAR, newrun)
+        ingest(PATH, PATH_GEAR, [test_newrun(sys.argv[1])], PATH_STORE)
     except IndexError:
         print("""New run must be provided as either:
 `"YYYY-MM-DD HH:MM:SS,KK.MM,[kw,kb,p,t,b]"`
 or
 `"HH:MM:SS,KK.MM,[kw,kb,p,t,b]"`
-in which case TODAY\'s date will be inserted automatically.""")
+in which case TODAY\'s date will be inserted automatically.
+Or use `--bulk FILE` to import one run per line from FILE (`-` for stdin),
+and `--compact` to fold the gear ledger into the gear file.""")
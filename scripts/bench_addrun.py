@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+import statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(statement, repeat=10):
+    """Median time in ms taken by `statement` in a fresh interpreter, so nothing is cached in sys.modules"""
+    def run(code):
+        out = subprocess.run([sys.executable, '-c',
+                              f'import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)'],
+                             cwd=HERE, capture_output=True, text=True, check=True)
+        return float(out.stdout) * 1000
+    return statistics.median(run(statement) for _ in range(repeat))
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for statement in ('import addrun', 'import pandas'):
+        print(f'{statement:<16} {time_import(statement, repeat):8.1f} ms')
@@ -0,0 +1,38 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from kata_tracking import get_notebook_to_send, get_notebooks_to_send
+
+
+def make_sheet(n_students=100_000, n_notebooks=200, seed=0):
+    """Synthetic tracking sheet, each student part way through the notebooks"""
+    rng = np.random.default_rng(seed)
+    columns = ['How_to_use_these_kata.ipynb'] + [f'kata_{i:03d}_solution.ipynb' for i in range(n_notebooks - 1)]
+    sent = rng.integers(0, n_notebooks + 1, n_students)
+    dates = np.where(np.arange(n_notebooks) < sent[:, None], '2021-03-01', None)
+    df = pd.DataFrame(dates, columns=columns)
+    df.insert(0, 'email', [f'student{i}@example.com' for i in range(n_students)])
+    df.insert(0, 'recipient', [f'student{i}' for i in range(n_students)])
+    return df
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t
+
+
+if __name__ == '__main__':
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_notebooks = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    df = make_sheet(n_students, n_notebooks)
+    fast, t_fast = timed(get_notebooks_to_send, df, './notebooks/')
+    print(f'{n_students} students x {n_notebooks} notebooks')
+    print(f'mask/argmax  {t_fast * 1000:10.1f} ms')
+    slow, t_slow = timed(lambda: df.apply(get_notebook_to_send, axis=1, args=(df, './notebooks/')))
+    print(f'row apply    {t_slow * 1000:10.1f} ms  ({t_slow / t_fast:.0f}x slower)')
+    assert fast == {row: d for row, d in slow.items() if d is not None}, 'selections differ'
+    print(f'same {len(fast)} notebooks selected')
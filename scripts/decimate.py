@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling
+    Keeps the first and last points and, for each bucket in between, the point
+    forming the largest triangle with the previous kept point and the mean of
+    the next bucket, which preserves peaks and the overall shape of the series.
+    Args:
+        x, y: 1D arrays of equal length, x sorted
+        n_out: number of points to keep
+    Returns:
+        indices of the kept points
+    References:
+        Steinarsson, S. (2013) Downsampling Time Series for Visual Representation, MSc thesis
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.shape[0]
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(int), n)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt = slice(edges[i + 1], edges[i + 2])
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def minmax(x, y, n_out):
+    """Min/max bucket downsampling, keeps the lowest and highest point of each of `n_out // 2` buckets
+    Returns:
+        sorted indices of the kept points
+    """
+    y = np.asarray(y, dtype=float)
+    n = y.shape[0]
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    width = np.diff(edges).max()
+    # pad every bucket to the same width so one argmin/argmax covers them all
+    pos = edges[:-1, None] + np.arange(width)
+    valid = pos < edges[1:, None]
+    pos = np.where(valid, pos, edges[1:, None] - 1)
+    lo = pos[np.arange(n_buckets), np.argmin(np.where(valid, y[pos], np.inf), axis=1)]
+    hi = pos[np.arange(n_buckets), np.argmax(np.where(valid, y[pos], -np.inf), axis=1)]
+    return np.unique(np.concatenate([lo, hi]))
+
+
+METHODS = {'lttb': lttb, 'minmax': minmax}
+
+
+def decimate_series(s, n_out, method='lttb'):
+    """Downsample a time-indexed Series to about `n_out` points, NaNs are dropped first"""
+    s = s.dropna()
+    if s.shape[0] <= n_out:
+        return s
+    idx = METHODS[method](s.index.asi8, s.to_numpy(), n_out)
+    return s.iloc[idx]
+
+
+def bin_runtime(total_time):
+    """Aggregate run times into weekly or monthly bars depending on the visible range
+    Args:
+        total_time: Series of run time [min] on a DatetimeIndex
+    Returns:
+        x: bar centres, height: mean run time per bin, width: bar width in days
+    """
+    span_days = (total_time.index[-1] - total_time.index[0]).days
+    freq, days = ('W', 7) if span_days <= 2 * 365 else ('MS', 30)
+    binned = total_time.resample(freq).mean().dropna()
+    # weekly bins are labelled on their last day, monthly bins on their first
+    offset = -days / 2 if freq == 'W' else days / 2
+    x = binned.index + pd.Timedelta(days=offset)
+    return x, binned.to_numpy(), days * 0.8
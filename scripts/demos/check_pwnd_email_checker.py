@@ -0,0 +1,106 @@
+########################################################
+#
+# Check the async engine of `pwnd_email_checker.py` against a local
+# stub of the breachedaccount API, no network or API key needed:
+#
+# - one account is rate limited once (429 with Retry-After), then pwned
+# - some accounts are pwned (200), the others clear (404)
+#
+# and the results, the request pacing and the Retry-After pause are asserted.
+#
+########################################################
+#
+# Usage:
+#
+# $ python check_pwnd_email_checker.py
+#
+########################################################
+
+import sys
+import json
+import time
+import types
+import asyncio
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import enviro
+except ImportError:
+    # the real credentials are not needed against the stub
+    sys.modules['enviro'] = types.SimpleNamespace(account_list=[], haveibeenpwnd_API_key='')
+
+import pwnd_email_checker
+
+RATE = 5
+RETRY_AFTER = 1
+BREACH = [{'Name': 'Adobe', 'BreachDate': '2013-10-04', 'AddedDate': '2013-12-04T00:00:00Z', 'IsVerified': True}]
+
+
+def make_handler(log, limited):
+    """Stub handler: `limited` accounts get one 429, `pwned*` accounts a breach, the rest 404"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            account = urllib.parse.unquote(urllib.parse.urlparse(self.path).path.rsplit('/', 1)[-1])
+            log.append((time.monotonic(), account))
+            if account in limited:
+                limited.discard(account)
+                self.send_response(429)
+                self.send_header('Retry-After', str(RETRY_AFTER))
+                self.end_headers()
+                return
+            if account.startswith('pwned') or account.startswith('limited'):
+                body = json.dumps(BREACH).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def check(n_pwned=4, n_clear=4):
+    accounts = ([f'pwned{i}@example.com' for i in range(n_pwned)] + ['limited@example.com']
+                + [f'clear{i}@example.com' for i in range(n_clear)])
+    log = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(log, {'limited@example.com'}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f'http://127.0.0.1:{server.server_port}/api/v3/breachedaccount/'
+    try:
+        results = asyncio.run(pwnd_email_checker.check_accounts_async(
+            accounts, api_key='stub', rate=RATE, burst=1, concurrency=4, backoff=0.1, api_url=api_url))
+    finally:
+        server.shutdown()
+
+    by_account = {res['account']: res for res in results}
+    assert [res['account'] for res in results] == accounts, 'results not in input order'
+    for account, res in by_account.items():
+        expected = 'clear' if account.startswith('clear') else 'pwned'
+        assert res['status'] == expected, f'{account}: {res}'
+        if expected == 'pwned':
+            assert res['breaches'] == pwnd_email_checker.parse_breaches(BREACH), f'{account}: {res}'
+    assert by_account['limited@example.com']['attempts'] == 2, by_account['limited@example.com']
+    assert len(log) == len(accounts) + 1, f'{len(log)} requests for {len(accounts)} accounts'
+
+    # token bucket: never faster than RATE per second, small scheduling slack allowed
+    times = [t for t, _ in log]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) >= 1 / RATE * 0.8, f'requests {min(gaps):.3f}s apart, limit is {1 / RATE:.3f}s'
+    # Retry-After: nobody is let through until it has passed
+    t_429 = next(t for t, account in log if account == 'limited@example.com')
+    after = [t for t in times if t > t_429]
+    assert after and after[0] - t_429 >= RETRY_AFTER * 0.95, f'next request {after[0] - t_429:.2f}s after the 429'
+    print(f'OK: {len(accounts)} accounts, {len(log)} requests, min gap {min(gaps):.3f}s, '
+          f'{after[0] - t_429:.2f}s pause after 429')
+
+
+if __name__ == '__main__':
+    check()
@@ -0,0 +1,76 @@
+########################################################
+#
+# Check `pwnd_index.py` on synthetic dumps, no download needed:
+#
+# the same random hashes, plus some in the first (0000) and last (FFFF)
+# prefix buckets, are written once ordered by hash and once shuffled,
+# indexed in small chunks, and every hash, a set of misses and both
+# prefix boundaries are looked up in both indexes.
+#
+########################################################
+#
+# Usage:
+#
+# $ python check_pwnd_index.py [n_hashes]
+#
+########################################################
+
+import os
+import sys
+import random
+import hashlib
+import tempfile
+
+import pwnd_index
+
+
+def make_hashes(n, seed=0):
+    """`n` random hashes with counts, including the lowest and highest prefixes"""
+    rng = random.Random(seed)
+    digests = {hashlib.sha1(str(rng.random()).encode()).hexdigest().upper() for _ in range(n)}
+    digests |= {'0000' + 'A' * 36, '0000' + '0' * 36, 'FFFF' + '1' * 36, 'F' * 40}
+    return {digest: rng.randint(1, 10**6) for digest in digests}
+
+
+def write_dump(path, hashes, order):
+    with open(path, 'w') as f:
+        for digest in order:
+            f.write(f'{digest}:{hashes[digest]}\r\n')
+
+
+def check(n=20000):
+    hashes = make_hashes(n)
+    ordered = sorted(hashes)
+    shuffled = list(hashes)
+    random.Random(1).shuffle(shuffled)
+    misses = ['0000' + '0' * 35 + '1', 'FFFF' + '0' * 36, 'FFFE' + 'F' * 36,
+              hashlib.sha1(b'not in the dump').hexdigest().upper()]
+    misses = [m for m in misses if m not in hashes]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, order in (('ordered', ordered), ('shuffled', shuffled)):
+            dump, out = os.path.join(tmp, f'{name}.txt'), os.path.join(tmp, f'{name}.idx')
+            write_dump(dump, hashes, order)
+            # small chunks, so ordering is also checked across chunk boundaries
+            assert pwnd_index.build_index(dump, out, chunk_lines=1000) == len(hashes), name
+            index = pwnd_index.open_index(out)
+            try:
+                assert index['n'] == len(hashes), f"{name}: {index['n']} records for {len(hashes)} hashes"
+                for digest, count in hashes.items():
+                    assert pwnd_index.lookup(index, digest) == count, f'{name}: {digest} not found'
+                    assert pwnd_index.lookup(index, digest.lower()) == count, f'{name}: {digest} lower case'
+                for digest in misses:
+                    assert pwnd_index.lookup(index, digest) == 0, f'{name}: {digest} found'
+                # the prefix buckets cover all records, first and last ones included
+                first, last = (pwnd_index.struct.unpack_from('<Q', index['mmap'], pwnd_index.HEADER + i * 8)[0]
+                               for i in (0, pwnd_index.N_PREFIX))
+                assert first == 0 and last == len(hashes), f'{name}: offsets {first}..{last}'
+            finally:
+                pwnd_index.close_index(index)
+        with open(os.path.join(tmp, 'ordered.idx'), 'rb') as f, open(os.path.join(tmp, 'shuffled.idx'), 'rb') as g:
+            assert f.read() == g.read(), 'ordered and shuffled dumps give different indexes'
+    print(f'OK: {len(hashes)} hashes, {len(misses)} misses, ordered and shuffled dumps index the same')
+
+
+if __name__ == '__main__':
+    check(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
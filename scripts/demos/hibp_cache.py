@@ -0,0 +1,178 @@
+########################################################
+#
+# On-disk cache for haveibeenpwned.com responses
+#
+# Shared by `pwndchecker.py` (password ranges) and
+# `pwnd_email_checker.py` (breached accounts) so repeated audits
+# are mostly served locally:
+#
+# - SQLite file, one row per URL
+# - per-entry time to live
+# - least recently used entries evicted past a total size
+# - stale entries with an ETag are revalidated with If-None-Match
+# - hit / miss / revalidation counters
+#
+########################################################
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'hibp_cache.sqlite')
+# only answers worth remembering: found, and not found
+CACHEABLE = {200, 404}
+
+
+class CachedResponse:
+    """
+    the parts of a `requests.Response` the checkers use
+    """
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """
+    SQLite backed response cache with TTL, LRU size bound and ETag revalidation
+    args:
+        path: SQLite file, created if needed
+        ttl: seconds an entry is fresh
+        max_bytes: total size of stored bodies kept before evicting the least recently used
+    """
+    def __init__(self, path=DEFAULT_PATH, ttl=24 * 3600, max_bytes=256 * 2**20):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                               url TEXT PRIMARY KEY,
+                               status INTEGER,
+                               body TEXT,
+                               etag TEXT,
+                               expires REAL,
+                               accessed REAL,
+                               size INTEGER)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def lookup(self, url):
+        """
+        returns:
+            (entry dict or None, fresh bool), and touches the entry for LRU
+        """
+        with self.lock:
+            row = self.db.execute('SELECT status, body, etag, expires FROM responses WHERE url = ?',
+                                  (url,)).fetchone()
+            if row is None:
+                return None, False
+            now = time.time()
+            self.db.execute('UPDATE responses SET accessed = ? WHERE url = ?', (now, url))
+        status, body, etag, expires = row
+        return {'status': status, 'body': body, 'etag': etag}, expires > now
+
+    def store(self, url, status, body, etag=None, ttl=None):
+        """
+        store a response and evict least recently used entries past `max_bytes`
+        """
+        now = time.time()
+        size = len(body.encode())
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, status, body, etag, now + (self.ttl if ttl is None else ttl), now, size))
+            self.stats['stores'] += 1
+            total, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+            while total > self.max_bytes:
+                # oldest first, a batch at a time
+                for old_url, old_size in self.db.execute(
+                        'SELECT url, size FROM responses ORDER BY accessed LIMIT 64').fetchall():
+                    self.db.execute('DELETE FROM responses WHERE url = ?', (old_url,))
+                    self.stats['evictions'] += 1
+                    total -= old_size
+                    if total <= self.max_bytes:
+                        break
+
+    def refresh(self, url, ttl=None):
+        """
+        mark an entry fresh again after a 304 Not Modified
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('UPDATE responses SET expires = ?, accessed = ? WHERE url = ?',
+                            (now + (self.ttl if ttl is None else ttl), now, url))
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def close(self):
+        self.db.close()
+
+
+def cached_response(cache, url):
+    """
+    look a URL up once, for callers that need to know before going to the network
+    args:
+        cache: `ResponseCache`, or None
+        url: full URL
+    returns:
+        (entry, response): `response` is the fresh cached answer or None, `entry`
+        the stored one, None if there is none, to pass on to `fetch`
+    """
+    if cache is None:
+        return None, None
+    entry, fresh = cache.lookup(url)
+    if entry is not None and fresh:
+        cache.count('hits')
+        return entry, CachedResponse(entry['status'], entry['body'])
+    return entry, None
+
+
+def fetch(session, url, entry=None, headers=None, cache=None, ttl=None, timeout=30):
+    """
+    GET from the network, revalidating the stale `entry` from `cached_response`
+    and storing the answer, see `cached_get` for the args
+    returns:
+        a `requests.Response` or `CachedResponse`
+    """
+    if cache is None:
+        return session.get(url, headers=headers, timeout=timeout)
+    headers = dict(headers or {})
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    r = session.get(url, headers=headers, timeout=timeout)
+    if r.status_code == 304 and entry is not None:
+        cache.count('revalidated')
+        cache.refresh(url, ttl)
+        return CachedResponse(entry['status'], entry['body'])
+    cache.count('misses')
+    if r.status_code in CACHEABLE:
+        cache.store(url, r.status_code, r.text, r.headers.get('ETag'), ttl)
+    return r
+
+
+def cached_get(session, url, headers=None, cache=None, ttl=None, timeout=30):
+    """
+    GET through the cache
+    args:
+        session: `requests` module or a `requests.Session`
+        url: full URL, also the cache key so never put secrets in it
+        headers: request headers, e.g. the API key
+        cache: `ResponseCache`, or None to always go to the network
+        ttl: override the cache's time to live for this entry
+    returns:
+        a `requests.Response` or `CachedResponse`
+    """
+    entry, r = cached_response(cache, url)
+    if r is not None:
+        return r
+    return fetch(session, url, entry, headers, cache, ttl, timeout)
@@ -1,8 +1,15 @@
-import numpy as np
-import matplotlib.pyplot as plt
-from ipywidgets import interact, interactive, fixed, interact_manual
+from ipywidgets import interact
 import ipywidgets as widgets
 
+from IPython.display import display
+
+from seismic_volume import get_volume, clip_level
+from seismic_slices import SliceService, Prefetcher, SliceView
+
+VOLUME = '../../data/Penobscot_0-1000ms.npy'
+# one figure for the session, updated in place, use `%matplotlib widget` to redraw it live
+VIEW = None
+
 @interact(
     colormap=['viridis', 'plasma', 'inferno', 'magma', 'Greys', 'Greys_r'],
     section=widgets.RadioButtons(options=['inline', 'xline', 'timeslice'],
@@ -17,43 +24,42 @@ import ipywidgets as widgets
 def seismic_plotter(colormap, section, inline, xline, timeslice):
     """Plot a chosen seismic ILine, XLine or Timeslice with a choice of colormaps"""
     
-    # load a volume
-    vol = np.load('../../data/Penobscot_0-1000ms.npy')
+    # memory-mapped volume, opened on the first call only
+    vol = get_volume(VOLUME)
     
     # sections dictionary
     sections = {
-        'inline': {'amp': vol[inline,:,:].T, 'line': inline, 'shrink_val': 0.6, 
+        'inline': {'line': inline,
                   'axhline_y': timeslice, 'axhline_c': 'b', 
                   'axvline_x': xline, 'axvline_c': 'g',
                   'axspine_c': 'r'},
-        'xline': {'amp': vol[:,xline,:].T, 'line': xline, 'shrink_val': 0.5, 
+        'xline': {'line': xline,
                   'axhline_y': timeslice, 'axhline_c': 'b', 
                   'axvline_x': inline, 'axvline_c': 'r',
                   'axspine_c': 'g'},
-        'timeslice': {'amp': vol[:,:,timeslice], 'line': timeslice, 'shrink_val': 0.95, 
+        'timeslice': {'line': timeslice,
                   'axhline_y': xline, 'axhline_c': 'g', 
                   'axvline_x': inline, 'axvline_c': 'r',
                   'axspine_c': 'b'},
     }
 
-    # scale amplitudes
-    ma = np.percentile(vol, 98)
+    # scale amplitudes, cached after the first call
+    ma = clip_level(vol, 98)
     
-    # plot figure
-    fig, ax = plt.subplots(figsize=(18, 6), ncols=1)
+    # plot figure, created once, its colorbar keeps the same size for every section
+    global VIEW
+    if VIEW is None:
+        # neighbours in the direction of travel are loaded in the background,
+        # `VIEW.service.hit_rate` tells how often they were ready in time
+        VIEW = SliceView(Prefetcher(SliceService(vol), k=4), ma, figsize=(18, 6), aspect=0.5, shrink=0.6)
 
     sec = sections[section]    
-    im = ax.imshow(sec['amp'], aspect=0.5, vmin=-ma, vmax=ma, cmap=colormap)
-    ax.set_title(f'Penobscot_0-1000ms {section} {sec["line"]}')
-    plt.colorbar(im, ax=ax, shrink=sec['shrink_val']).set_label(colormap)
-     
-    # add projected lines
-    ax.axhline(y=sec['axhline_y'], linewidth=2, color=sec['axhline_c'])
-    ax.axvline(x=sec['axvline_x'], linewidth=2, color=sec['axvline_c'])
-    for axis in ['top','bottom','left','right']:
-        ax.spines[axis].set_linewidth(2)     
-        ax.spines[axis].set_color(sec['axspine_c'])
-    
-    plt.show()
+    # only the shown section is read, or taken from the cache of recent ones
+    VIEW.update(section, sec['line'],
+                hline=sec['axhline_y'], vline=sec['axvline_x'],
+                colors=(sec['axhline_c'], sec['axvline_c'], sec['axspine_c']),
+                cmap=colormap, title=f'Penobscot_0-1000ms {section} {sec["line"]}')
+    # `interact` clears its output before every call, so the same figure is shown again
+    display(VIEW.fig)
     
     return
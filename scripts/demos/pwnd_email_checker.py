@@ -12,6 +12,12 @@
 #
 # $ python pwnd_email_checker.py
 #
+# or, to check many accounts concurrently within the API rate limit:
+#
+# $ python pwnd_email_checker.py --fast
+#
+# Add `--cache` to keep responses in ~/.cache/hibp_cache.sqlite for a day.
+#
 # where `enviro.account_list` is a *.py file containing:
 # account_list = ['email1@domain.com', 'email2@domain.com']
 #
@@ -22,6 +28,14 @@ import json
 import urllib
 from enviro import account_list, haveibeenpwnd_API_key
 import time
+import sys
+import random
+import asyncio
+
+from hibp_cache import ResponseCache, CachedResponse, cached_get, cached_response, fetch
+
+API_URL = 'https://haveibeenpwned.com/api/v3/breachedaccount/'
+USER_AGENT = 'Pwnage-Checker-For-Manjaro'
 
 def encode_account(account):
     """
@@ -33,21 +47,38 @@ def encode_account(account):
     """
     return urllib.parse.quote(account)
 
-def query_api(account):
+def parse_breaches(results):
+    """
+    keep the interesting fields of each breach
+    args:
+        decoded JSON list returned by the breachedaccount API
+    returns:
+        dict like {'BreachName': {'BreachDate': ..., 'AddedDate': ..., 'IsVerified': ...}}
+    """
+    output = {}
+    for res in results:
+        output[res['Name']] = {'BreachDate': res['BreachDate'],
+                             'AddedDate': res['AddedDate'],
+                             'IsVerified': res['IsVerified'],
+                              }
+    return output
+
+def query_api(account, cache=None):
     """
     post GET request to haveibeenpwned.com to check whether given email has been pwnd
     args:
         email address to check like 'example@example.com'
+        optional `hibp_cache.ResponseCache` to serve recently checked accounts locally
 
     prints out response to CLI
 
     returns:
-        None
+        the response, a `hibp_cache.CachedResponse` when served from the cache
     """
     # set up and run query
-    headers = {'User-Agent': 'Pwnage-Checker-For-Manjaro', 'hibp-api-key': haveibeenpwnd_API_key}
-    url = 'https://haveibeenpwned.com/api/v3/breachedaccount/' + encode_account(account) + '?truncateResponse=false'
-    r = requests.get(url, headers=headers)
+    headers = {'User-Agent': USER_AGENT, 'hibp-api-key': haveibeenpwnd_API_key}
+    url = API_URL + encode_account(account) + '?truncateResponse=false'
+    r = cached_get(requests, url, headers=headers, cache=cache)
     #print(f'request status code: {r.status_code}')
 
     # check result code and print output
@@ -56,31 +87,27 @@ def query_api(account):
 
     if r.status_code == 404:
         print(f'Response code: {r.status_code} email not found — <{account}> has not been pwned\n')
-        return
+        return r
 
     if r.status_code == 200:
         raw_results = r.text
         results = json.loads(raw_results)
-        output = {}
-        for res in results:
-            output[res['Name']] = {'BreachDate': res['BreachDate'],
-                                 'AddedDate': res['AddedDate'],
-                                 'IsVerified': res['IsVerified'],
-                                  }
+        output = parse_breaches(results)
         print(f'Response code: {r.status_code} email found — <{account}> has been pwned {len(results)} times:')
         print(output)
         print('\n')
 
     if r.status_code == 429:
         print('Exceeding rate limit')
-    return
+    return r
 
-def check_accounts(account_list):
+def check_accounts(account_list, cache=None):
     """
     Calls `query_api()` on each account in a list of email accounts to see if any are pwnd
     args:
         list of accounts to check like:
         ['example1@example.com', 'example2@example.com', 'example3@example.com']
+        optional `hibp_cache.ResponseCache`
     returns:
         None
     """
@@ -89,11 +116,151 @@ def check_accounts(account_list):
         print(account)
     print('\n=======\n')
     for account in account_list:
-        query_api(account)
-        time.sleep(2)
+        r = query_api(account, cache)
+        # answers served from the cache don't count against the rate limit
+        if not isinstance(r, CachedResponse):
+            time.sleep(2)
 
     return
 
+class TokenBucket:
+    """
+    asyncio token bucket: `rate` requests per second with bursts of up to `burst`
+    `pause(seconds)` empties the bucket and holds every caller back, used for `Retry-After`
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # negative tokens take `seconds` to refill back to zero
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = time.monotonic()
+
+def retry_after(r, default):
+    """
+    seconds to wait from a `Retry-After` header, `default` if missing or not a number
+    """
+    try:
+        return float(r.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return default
+
+async def query_api_async(account, session, bucket, api_key, retries=5, backoff=1.0, api_url=API_URL,
+                          cache=None):
+    """
+    query the breachedaccount API for one account, waiting on the token bucket and
+    retrying on 429, 5xx and connection errors with exponential backoff
+    args:
+        account: email address to check like 'example@example.com'
+        session: `requests.Session` shared by all queries so connections are kept alive
+        bucket: `TokenBucket` shared by all queries
+        api_key: haveibeenpwned API key
+        cache: optional `hibp_cache.ResponseCache`, fresh entries skip the bucket
+    returns:
+        dict with 'account', 'status' ('pwned', 'clear' or 'error'), 'status_code',
+        'breaches' and 'attempts'
+    """
+    headers = {'User-Agent': USER_AGENT, 'hibp-api-key': api_key}
+    url = api_url + encode_account(account) + '?truncateResponse=false'
+    result = {'account': account, 'status': 'error', 'status_code': None, 'breaches': {}, 'attempts': 0}
+    for attempt in range(1, retries + 1):
+        result['attempts'] = attempt
+        # looked up once, fresh entries skip the bucket and the network
+        entry, r = cached_response(cache, url)
+        if r is None:
+            await bucket.acquire()
+            try:
+                r = await asyncio.to_thread(fetch, session, url, entry, headers, cache)
+            except requests.RequestException as e:
+                result['error'] = str(e)
+                await asyncio.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                continue
+        result['status_code'] = r.status_code
+        if r.status_code == 200:
+            result['status'] = 'pwned'
+            result['breaches'] = parse_breaches(r.json())
+            return result
+        if r.status_code == 404:
+            result['status'] = 'clear'
+            return result
+        if r.status_code == 429 or r.status_code >= 500:
+            wait = retry_after(r, backoff * 2 ** (attempt - 1))
+            if r.status_code == 429:
+                bucket.pause(wait)
+            else:
+                await asyncio.sleep(wait)
+            continue
+        # 400, 401, 403: retrying will not help
+        result['error'] = r.text
+        return result
+    return result
+
+async def check_accounts_async(account_list, api_key=haveibeenpwnd_API_key, rate=0.5, burst=1,
+                               concurrency=8, retries=5, backoff=1.0, api_url=API_URL, cache=None):
+    """
+    check many accounts concurrently over a pool of keep-alive connections
+    args:
+        account_list: list of accounts to check
+        api_key: haveibeenpwned API key
+        rate, burst: token bucket, requests per second allowed by your API key
+        concurrency: maximum requests in flight, also the connection pool size
+        retries, backoff: attempts per account and base backoff in seconds
+        api_url: breachedaccount endpoint, e.g. a local stub server for testing
+        cache: optional `hibp_cache.ResponseCache`
+    returns:
+        list of result dicts from `query_api_async`, in `account_list` order
+    """
+    bucket = TokenBucket(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        async def one(account):
+            async with semaphore:
+                return await query_api_async(account, session, bucket, api_key, retries, backoff, api_url, cache)
+
+        return await asyncio.gather(*(one(account) for account in account_list))
+
+def check_accounts_fast(account_list, **kwargs):
+    """
+    run `check_accounts_async` and print a summary like `check_accounts`
+    returns:
+        list of result dicts
+    """
+    results = asyncio.run(check_accounts_async(account_list, **kwargs))
+    for res in results:
+        if res['status'] == 'pwned':
+            print(f'<{res["account"]}> has been pwned {len(res["breaches"])} times:')
+            print(res['breaches'])
+        elif res['status'] == 'clear':
+            print(f'<{res["account"]}> has not been pwned')
+        else:
+            print(f'<{res["account"]}> could not be checked (status {res["status_code"]}) {res.get("error", "")}')
+    return results
+
 if __name__ == "__main__":
-    check_accounts(account_list)
+    cache = ResponseCache() if '--cache' in sys.argv else None
+    if '--fast' in sys.argv:
+        check_accounts_fast(account_list, cache=cache)
+    else:
+        check_accounts(account_list, cache)
+    if cache is not None:
+        print(f'cache: {cache.stats}')
     print(f'\nDone, all accounts have been checked')
@@ -0,0 +1,160 @@
+########################################################
+#
+# Offline pwned passwords index
+#
+# Converts the downloadable SHA-1 dump from haveibeenpwned.com, lines of
+# `SHA1HEX:COUNT`, into a fixed-width binary file that `pwndchecker.py`
+# can search without any network access:
+#
+#   header   8 byte magic, uint64 number of records
+#   offsets  65,537 uint64, first record of each 4 hex character prefix
+#   records  sorted 20 byte digest + uint32 count, 24 bytes each
+#
+# Lookups memory-map the file and binary search one prefix bucket,
+# so only a few pages are ever read.
+#
+########################################################
+#
+# Usage:
+#
+# $ python pwnd_index.py pwned-passwords-sha1-ordered-by-hash.txt pwned.idx
+#
+########################################################
+
+import sys
+import mmap
+import struct
+
+MAGIC = b'PWNIDX01'
+N_PREFIX = 65536
+HEADER = len(MAGIC) + 8
+OFFSETS_SIZE = (N_PREFIX + 1) * 8
+RECORD = struct.Struct('<20sI')
+# the 20 byte digest seen as big-endian integers, so numpy compares and sorts it byte-wise
+KEY_DTYPE = [('a', '>u8'), ('b', '>u8'), ('c', '>u4'), ('count', '<u4')]
+
+def _parse_chunk(lines):
+    """
+    turn a list of `HEX:COUNT` lines into digest and count arrays
+    args:
+        list of byte lines from the dump
+    returns:
+        structured array of ('digest', 'V20'), ('count', '<u4')
+    """
+    import numpy as np
+
+    lut = np.zeros(256, dtype=np.uint8)
+    for i, c in enumerate(b'0123456789ABCDEF'):
+        lut[c] = i
+        lut[ord(chr(c).lower())] = i
+    hexbuf = np.frombuffer(b''.join(line[:40] for line in lines), dtype=np.uint8)
+    nibbles = lut[hexbuf].reshape(-1, 40)
+    digests = (nibbles[:, ::2] << 4) | nibbles[:, 1::2]
+    records = np.empty(len(lines), dtype=[('digest', 'V20'), ('count', '<u4')])
+    records['digest'] = digests.view('V20').ravel()
+    records['count'] = [int(line[41:]) for line in lines]
+    return records
+
+def _in_order(prev, keys):
+    """
+    whether `keys` (KEY_DTYPE) are sorted and follow the last key `prev` of the previous chunk
+    """
+    import numpy as np
+
+    if prev is not None:
+        keys = np.concatenate([prev[None], keys])
+    x, y = keys[:-1], keys[1:]
+    return bool(np.all((y['a'] > x['a']) | ((y['a'] == x['a']) & (
+        (y['b'] > x['b']) | ((y['b'] == x['b']) & (y['c'] >= x['c']))))))
+
+def build_index(dump, out, chunk_lines=1_000_000):
+    """
+    stream a text dump into a sorted binary index
+    args:
+        - dump: path to a `SHA1HEX:COUNT` text file
+        - out: path of the index to write
+        - chunk_lines: lines parsed at a time, bounds memory use
+    returns:
+        number of records written
+    """
+    import numpy as np
+
+    n = 0
+    in_order = True
+    last = None
+    with open(dump, 'rb') as f, open(out, 'wb') as g:
+        g.write(MAGIC + struct.pack('<Q', 0) + bytes(OFFSETS_SIZE))
+        while True:
+            lines = [line for line in f.readlines(chunk_lines * 50) if line.strip()]
+            if not lines:
+                break
+            records = _parse_chunk(lines)
+            keys = records.view(KEY_DTYPE)
+            # the official dump is ordered by hash, check rather than assume
+            in_order = in_order and _in_order(last, keys)
+            last = keys[-1].copy()
+            g.write(records.tobytes())
+            n += len(records)
+
+    with open(out, 'r+b') as g:
+        records = np.memmap(g, dtype=[('digest', 'V20'), ('count', '<u4')], mode='r+',
+                            offset=HEADER + OFFSETS_SIZE, shape=(n,))
+        if not in_order:
+            # only needed for unordered dumps, this one holds the whole dump in memory
+            keys = np.sort(records.view(KEY_DTYPE), order=['a', 'b', 'c'])
+            records[:] = keys.view(records.dtype)
+        prefix = records.view([('prefix', '>u2'), ('rest', 'V22')])['prefix']
+        offsets = np.zeros(N_PREFIX + 1, dtype='<u8')
+        offsets[1:] = np.cumsum(np.bincount(prefix, minlength=N_PREFIX))
+        records.flush()
+        del records
+        g.seek(0)
+        g.write(MAGIC + struct.pack('<Q', n) + offsets.tobytes())
+    return n
+
+def open_index(path):
+    """
+    memory-map an index built by `build_index`
+    returns:
+        dict with the open file, its mmap and the number of records
+    """
+    f = open(path, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a pwned passwords index')
+    n, = struct.unpack_from('<Q', mm, len(MAGIC))
+    return {'file': f, 'mmap': mm, 'n': n}
+
+def lookup(index, decoded_hash):
+    """
+    count for a hashed password, a binary search within its prefix bucket
+    args:
+        - index: dict from `open_index`
+        - a single hashed password as a hex string
+    returns:
+        pwned count, 0 when not in the dump
+    """
+    mm = index['mmap']
+    digest = bytes.fromhex(decoded_hash)
+    prefix = int.from_bytes(digest[:2], 'big')
+    lo, hi = struct.unpack_from('<QQ', mm, HEADER + prefix * 8)
+    base = HEADER + OFFSETS_SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = base + mid * RECORD.size
+        key = mm[pos:pos + 20]
+        if key < digest:
+            lo = mid + 1
+        elif key > digest:
+            hi = mid
+        else:
+            return RECORD.unpack_from(mm, pos)[1]
+    return 0
+
+def close_index(index):
+    index['mmap'].close()
+    index['file'].close()
+
+if __name__ == "__main__":
+    n = build_index(sys.argv[1], sys.argv[2])
+    print(f'{n} hashes indexed in {sys.argv[2]}')
@@ -25,11 +25,35 @@
 #
 # password,password124,secret,*secret,secr*et
 #
+# Add `--batch` to look up each 5 character hash prefix only once,
+# with the prefix ranges fetched concurrently:
+#
+# $ python pwndchecker.py pwd_list.txt --batch
+#
+# or, for air-gapped audits, against a local index built by `pwnd_index.py`:
+#
+# $ python pwndchecker.py pwd_list.txt --offline pwned.idx
+#
+# Add `--cache` to keep range responses in ~/.cache/hibp_cache.sqlite
+# for a day, so repeated audits mostly stay off the network.
+#
+# For very large lists add `--stream`: the file is read in chunks, comma or
+# newline separated, hashed in a process pool and spilled to temporary files
+# by hash prefix, so each range is fetched only once however large the list,
+# printing only the pwned passwords. Combines with `--offline` and `--cache`.
+#
 ########################################################
 
+import os
 import hashlib
 import requests
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from hibp_cache import ResponseCache, cached_get
+
+API_URL = 'https://api.pwnedpasswords.com/range/'
 
 def read_file(filename):
     """
@@ -59,18 +83,19 @@ def make_hash(pwd):
     decoded_hash = hashed_pwd.hexdigest()
     return decoded_hash
 
-def query_api(decoded_hash):
+def query_api(decoded_hash, cache=None):
     """
     query the API with the first 5 characters of the decoded hashed password (the prefix) using https
     args:
-        a single hashed password as a string
+        - a single hashed password as a string
+        - optional `hibp_cache.ResponseCache` to serve recently checked prefixes locally
     returns:
         - the status code that should always be 200, the API should not return a 404
         - a list of suffixes matching the prefix and the count of how many times each was found
     """
     prefix = decoded_hash[:5]
-    url = 'https://api.pwnedpasswords.com/range/' + prefix
-    r = requests.get(url)
+    url = API_URL + prefix
+    r = cached_get(requests, url, cache=cache)
     print(f'request status code: {r.status_code}')
     api_results = r.text.split()
     return api_results
@@ -96,11 +121,240 @@ def pwned_count(query_api_results, decoded_hash):
         print(f'CLEAR: {suffix.upper()} was not in the pwned database.')
     return
 
+def parse_range(text):
+    """
+    parse a range response once into a lookup table
+    args:
+        the body returned for a prefix, lines of `SUFFIX:COUNT`
+    returns:
+        dict of upper case suffix to count
+    """
+    table = {}
+    for line in text.split():
+        suffix, _, count = line.partition(':')
+        table[suffix.upper()] = int(count)
+    return table
+
+def group_by_prefix(hashes):
+    """
+    group hashes by the 5 character prefix sent to the API
+    args:
+        iterable of hashed passwords as hex strings
+    returns:
+        dict of upper case prefix to set of upper case hashes
+    """
+    groups = {}
+    for decoded_hash in hashes:
+        decoded_hash = decoded_hash.upper()
+        groups.setdefault(decoded_hash[:5], set()).add(decoded_hash)
+    return groups
+
+def query_range(session, prefix, api_url=API_URL, cache=None):
+    """
+    fetch and parse the range for one prefix
+    args:
+        - a `requests.Session` shared between threads to reuse connections
+        - a 5 character hash prefix
+        - optional `hibp_cache.ResponseCache`
+    returns:
+        dict of upper case suffix to count, see `parse_range`
+    """
+    r = cached_get(session, api_url + prefix, cache=cache)
+    if r.status_code != 200:
+        raise requests.HTTPError(f'{r.status_code} for prefix {prefix}')
+    return parse_range(r.text)
+
+def check_hashes(hashes, workers=8, api_url=API_URL, cache=None):
+    """
+    look up many hashes with one request per distinct prefix, run concurrently
+    args:
+        - iterable of hashed passwords as hex strings
+        - number of concurrent requests
+        - optional `hibp_cache.ResponseCache`
+    returns:
+        dict of upper case hash to pwned count, 0 when not found
+    """
+    groups = group_by_prefix(hashes)
+    counts = {}
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            tables = pool.map(lambda prefix: query_range(session, prefix, api_url, cache), groups)
+            for (prefix, group), table in zip(groups.items(), tables):
+                for decoded_hash in group:
+                    counts[decoded_hash] = table.get(decoded_hash[5:], 0)
+    return counts
+
+def check_hashes_offline(hashes, index_path):
+    """
+    look up many hashes in a local index built by `pwnd_index.py`, no network needed
+    args:
+        - iterable of hashed passwords as hex strings
+        - path to the index file
+    returns:
+        dict of upper case hash to pwned count, 0 when not found
+    """
+    import pwnd_index
+
+    index = pwnd_index.open_index(index_path)
+    try:
+        return {h.upper(): pwnd_index.lookup(index, h) for h in hashes}
+    finally:
+        pwnd_index.close_index(index)
+
+def report(counts):
+    """
+    print the results of `check_hashes` like `pwned_count`
+    """
+    for decoded_hash, count in counts.items():
+        if count:
+            print(f'WARNING: {decoded_hash[5:]} was pwned {count} times.')
+        else:
+            print(f'CLEAR: {decoded_hash[5:]} was not in the pwned database.')
+    return
+
+def iter_passwords(filename, chunk_size=100_000, block_size=2**20):
+    """
+    stream passwords from a comma and/or newline separated file
+    args:
+        - filename, a relative path as a string
+        - number of passwords per chunk
+        - bytes read from the file at a time
+    returns:
+        generator of password lists of up to chunk_size passwords
+    """
+    chunk = []
+    tail = ''
+    with open(filename, 'r') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            tokens = (tail + block).replace('\n', ',').split(',')
+            # the last token may continue in the next block
+            tail = tokens.pop()
+            for pwd in tokens:
+                pwd = pwd.strip()
+                if pwd:
+                    chunk.append(pwd)
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+    if tail.strip():
+        chunk.append(tail.strip())
+    if chunk:
+        yield chunk
+
+def hash_chunk(pwds):
+    """
+    hash a list of passwords, run in a worker process by `iter_hashes`
+    """
+    return [make_hash(pwd) for pwd in pwds]
+
+def iter_hashes(chunks, processes=None):
+    """
+    hash password chunks in a process pool, in order, with at most 2 chunks per
+    process in flight so memory stays bounded whatever the input size
+    args:
+        - iterable of password lists, e.g. from `iter_passwords`
+        - number of worker processes, defaults to the CPU count
+    returns:
+        generator of hash lists
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        window = 2 * processes
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(hash_chunk, chunk))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_buckets(hash_chunks, width=2):
+    """
+    regroup hashes so each 5 character prefix ends up in exactly one group,
+    spilling them to temporary files keyed by their first `width` hex characters
+    args:
+        - iterable of hash lists, e.g. from `iter_hashes`
+        - hex characters of the spill key, up to 16**width files
+    returns:
+        generator of hash lists, one per spill file
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {}
+        try:
+            for hashes in hash_chunks:
+                spill = {}
+                for decoded_hash in hashes:
+                    spill.setdefault(decoded_hash[:width].upper(), []).append(decoded_hash + '\n')
+                for key, lines in spill.items():
+                    if key not in files:
+                        files[key] = open(os.path.join(tmp, key), 'w')
+                    files[key].writelines(lines)
+        finally:
+            for f in files.values():
+                f.close()
+        for key in sorted(files):
+            with open(os.path.join(tmp, key)) as f:
+                yield f.read().split()
+
+def audit_file(filename, processes=None, chunk_size=100_000, workers=8, cache=None, index_path=None,
+               api_url=API_URL):
+    """
+    stream, hash and check a password file of any size
+    args:
+        - filename, comma and/or newline separated passwords
+        - processes: hashing worker processes
+        - chunk_size: passwords per chunk
+        - workers: concurrent range requests
+        - cache: optional `hibp_cache.ResponseCache`, not needed within one audit
+          as the hashes are regrouped by `iter_buckets` and each prefix is fetched once
+        - index_path: check against a local `pwnd_index.py` index instead of the API
+    returns:
+        generator of dicts of upper case hash to pwned count, one per chunk offline,
+        one per prefix bucket against the API
+    """
+    hash_chunks = iter_hashes(iter_passwords(filename, chunk_size), processes)
+    if index_path is not None:
+        for hashes in hash_chunks:
+            yield check_hashes_offline(hashes, index_path)
+        return
+    for hashes in iter_buckets(hash_chunks):
+        yield check_hashes(hashes, workers, api_url, cache)
+
 if __name__ == "__main__":
+    cache = ResponseCache() if '--cache' in sys.argv else None
+    if '--stream' in sys.argv:
+        index_path = sys.argv[sys.argv.index('--offline') + 1] if '--offline' in sys.argv else None
+        n, n_pwned = 0, 0
+        for counts in audit_file(sys.argv[1], cache=cache, index_path=index_path):
+            n += len(counts)
+            for decoded_hash, count in counts.items():
+                if count:
+                    n_pwned += 1
+                    print(f'WARNING: {decoded_hash[5:]} was pwned {count} times.')
+        print(f'{n_pwned} of {n} hashes checked were pwned.')
+        sys.exit()
     pwd_list = read_file(sys.argv[1])
     hashed_pwds = [make_hash(pwd) for pwd in pwd_list]
+    if '--offline' in sys.argv or '--batch' in sys.argv:
+        if '--offline' in sys.argv:
+            report(check_hashes_offline(hashed_pwds, sys.argv[sys.argv.index('--offline') + 1]))
+        else:
+            report(check_hashes(hashed_pwds, cache=cache))
+        del pwd_list, hashed_pwds
+        print('All variables have been deleted.')
+        sys.exit()
     for hashed_pwd in hashed_pwds:
-        api_results = query_api(hashed_pwd)
+        api_results = query_api(hashed_pwd, cache)
         pwned_count(api_results, hashed_pwd)
+    if cache is not None:
+        print(f'cache: {cache.stats}')
     del pwd_list, hashed_pwd, hashed_pwds, api_results
     print('All variables have been deleted.')
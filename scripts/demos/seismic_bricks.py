@@ -0,0 +1,206 @@
+"""Bricked storage for seismic cubes
+
+A C-ordered `.npy` cube is fast to read along inlines but a timeslice
+touches every page of the file. Re-tiling the cube into small cubic bricks
+makes inline, xline and timeslice reads all cost about the same: the
+bricks crossing the section, one brick thick.
+
+A bricked cube is a directory:
+
+    meta.json    shape, brick size, stored dtype, codec, quantization scale
+    index.npy    (n_i, n_x, n_t, 2) int64 byte offset and length of each brick
+    bricks.bin   the bricks, each padded to a full brick, C-ordered
+
+Bricks can be stored as float32, or quantized to int8/int16 with a single
+scale (lossy), and each one optionally zlib compressed (lossless).
+
+Usage:
+
+$ python seismic_bricks.py Penobscot_0-1000ms.npy Penobscot_0-1000ms.bricks --quantize int16
+"""
+import os
+import sys
+import json
+import mmap
+import zlib
+import operator
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+BRICK = 32
+CODECS = ('none', 'zlib')
+QUANTIZE = {None: np.float32, 'int8': np.int8, 'int16': np.int16}
+
+
+def convert(src, out, brick=BRICK, codec='zlib', quantize=None):
+    """Re-tile a `.npy` cube into bricks, streaming a slab of inlines at a time
+    Args:
+        src [str]: `.npy` cube of shape (n_inlines, n_xlines, n_samples)
+        out [str]: directory to write
+        brick [int]: brick edge length [samples]
+        codec [str]: one of `CODECS`
+        quantize [str]: None to keep float32, or 'int8' / 'int16'
+    Returns:
+        meta [dict]: as written to `meta.json`
+    """
+    if codec not in CODECS:
+        raise ValueError(f'`codec` must be one of {CODECS}')
+    if quantize not in QUANTIZE:
+        raise ValueError(f'`quantize` must be one of {list(QUANTIZE)}')
+    data = np.load(src, mmap_mode='r')
+    shape = data.shape
+    n_bricks = [-(-n // brick) for n in shape]
+    dtype = np.dtype(QUANTIZE[quantize])
+    scale = 1.
+    if quantize is not None:
+        # the amplitude range comes from the statistics sidecar, one pass, reused
+        import seismic_stats
+        stats = seismic_stats.load_stats({'path': src, 'data': data, 'shape': shape})
+        peak = max(abs(stats['min']), abs(stats['max']))
+        scale = peak / np.iinfo(dtype).max if peak > 0 else 1.
+
+    os.makedirs(out, exist_ok=True)
+    index = np.zeros(n_bricks + [2], dtype=np.int64)
+    pos = 0
+    with open(os.path.join(out, 'bricks.bin'), 'wb') as f:
+        for bi in range(n_bricks[0]):
+            slab = np.asarray(data[bi * brick:(bi + 1) * brick], dtype=np.float32)
+            for bj in range(n_bricks[1]):
+                for bk in range(n_bricks[2]):
+                    block = np.zeros((brick, brick, brick), dtype=dtype)
+                    part = slab[:, bj * brick:(bj + 1) * brick, bk * brick:(bk + 1) * brick]
+                    if quantize is not None:
+                        part = np.rint(part / scale)
+                    block[:part.shape[0], :part.shape[1], :part.shape[2]] = part
+                    raw = block.tobytes()
+                    if codec == 'zlib':
+                        raw = zlib.compress(raw, 6)
+                    f.write(raw)
+                    index[bi, bj, bk] = pos, len(raw)
+                    pos += len(raw)
+    np.save(os.path.join(out, 'index.npy'), index)
+    meta = {'shape': list(shape),
+            'brick': brick,
+            'dtype': dtype.name,
+            'codec': codec,
+            'scale': scale,
+            }
+    # written last, a directory without it is an unfinished conversion
+    with open(os.path.join(out, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+class BrickedArray:
+    """Read-only, array-like view of a bricked cube
+    Supports `shape`, `dtype`, `ndim`, `nbytes` and basic indexing with
+    integers and slices, returning float32 NumPy arrays. Only the bricks
+    crossing the requested region are read and decoded, the most recently
+    used ones are kept in memory.
+    Args:
+        path [str]: directory written by `convert`
+        cache_bricks [int]: number of decoded bricks kept
+    """
+    def __init__(self, path, cache_bricks=256):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.shape = tuple(self.meta['shape'])
+        self.brick = self.meta['brick']
+        self.dtype = np.dtype(np.float32)
+        self.ndim = 3
+        self.nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.index = np.load(os.path.join(path, 'index.npy'))
+        self._stored = np.dtype(self.meta['dtype'])
+        self._file = open(os.path.join(path, 'bricks.bin'), 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cache = OrderedDict()
+        self._cache_bricks = cache_bricks
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def brick_at(self, bi, bj, bk):
+        """One decoded brick, float32, padded to the full brick size"""
+        key = (bi, bj, bk)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        offset, length = self.index[key]
+        raw = self._mmap[offset:offset + length]
+        if self.meta['codec'] == 'zlib':
+            raw = zlib.decompress(raw)
+        block = np.frombuffer(raw, dtype=self._stored).reshape((self.brick,) * 3)
+        if self._stored != np.float32:
+            block = block.astype(np.float32) * np.float32(self.meta['scale'])
+        with self._lock:
+            self._cache[key] = block
+            while len(self._cache) > self._cache_bricks:
+                self._cache.popitem(last=False)
+        return block
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError('too many indices for a 3D volume')
+        key = key + (slice(None),) * (3 - len(key))
+        ranges, squeeze = [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(n)))
+            else:
+                k = operator.index(k)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError(f'index {k} is out of bounds for axis {axis} with size {n}')
+                ranges.append(range(k, k + 1))
+                squeeze.append(axis)
+        if any(len(r) == 0 for r in ranges):
+            out = np.empty([len(r) for r in ranges], dtype=self.dtype)
+            return out.squeeze(axis=tuple(squeeze))
+
+        # read the bounding box of the request, brick by brick
+        lo = [min(r[0], r[-1]) for r in ranges]
+        hi = [max(r[0], r[-1]) + 1 for r in ranges]
+        b = self.brick
+        out = np.empty([h - l for l, h in zip(lo, hi)], dtype=self.dtype)
+        for bi in range(lo[0] // b, (hi[0] - 1) // b + 1):
+            for bj in range(lo[1] // b, (hi[1] - 1) // b + 1):
+                for bk in range(lo[2] // b, (hi[2] - 1) // b + 1):
+                    block = self.brick_at(bi, bj, bk)
+                    src, dst = [], []
+                    for axis, bn in enumerate((bi, bj, bk)):
+                        start, stop = max(lo[axis], bn * b), min(hi[axis], (bn + 1) * b)
+                        src.append(slice(start - bn * b, stop - bn * b))
+                        dst.append(slice(start - lo[axis], stop - lo[axis]))
+                    out[tuple(dst)] = block[tuple(src)]
+
+        if any(r.step != 1 for r in ranges):
+            out = out[np.ix_(*(np.asarray(r) - l for r, l in zip(ranges, lo)))]
+        return out.squeeze(axis=tuple(squeeze))
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def open_bricks(path, cache_bricks=256):
+    """Open a bricked cube as a volume dict, like `seismic_volume.open_volume`"""
+    data = BrickedArray(path, cache_bricks)
+    return {'path': path, 'data': data, 'shape': data.shape}
+
+
+if __name__ == "__main__":
+    quantize = sys.argv[sys.argv.index('--quantize') + 1] if '--quantize' in sys.argv else None
+    codec = sys.argv[sys.argv.index('--codec') + 1] if '--codec' in sys.argv else 'zlib'
+    brick = int(sys.argv[sys.argv.index('--brick') + 1]) if '--brick' in sys.argv else BRICK
+    meta = convert(sys.argv[1], sys.argv[2], brick, codec, quantize)
+    size = os.path.getsize(os.path.join(sys.argv[2], 'bricks.bin'))
+    print(f'{sys.argv[1]} {tuple(meta["shape"])} written to {sys.argv[2]}: '
+          f'{meta["brick"]}^3 bricks, {meta["dtype"]}, {meta["codec"]}, {size / 2**20:.1f} MB')
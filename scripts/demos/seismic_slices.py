@@ -0,0 +1,317 @@
+"""Slice service and in-place viewer for interactive seismic browsing
+
+- `build_pyramid` keeps decimated copies of a cube (every 2nd, 4th, 8th
+  sample along each axis) as memory-mapped `.npy` files next to it, built
+  once in a streaming pass and reused, like the statistics sidecar
+- `SliceService` reads sections at any level of detail through an LRU
+  cache of recently viewed sections
+- `Prefetcher` wraps a `SliceService` and loads the next few sections in
+  the direction the user is moving in background threads
+- `SliceView` owns one figure and updates its `imshow` artist, crosshair
+  lines and title in place instead of building a new figure per frame,
+  drawing no more samples than the axes have pixels
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from seismic_volume import SECTIONS, open_volume, section
+
+STEPS = (2, 4, 8)
+
+
+def pyramid_path(path, step):
+    """Filename of the level of a cube decimated by `step`"""
+    return f'{path.rstrip(os.sep)}.lod{step}.npy'
+
+
+def build_pyramid(vol, steps=STEPS, slab=64):
+    """Decimated levels of detail of a volume, built if missing or stale
+    Args:
+        vol [dict]: volume from `seismic_volume.open_volume`
+        steps [tuple]: decimation factors, one level each
+        slab [int]: output inlines written at a time, bounds memory use
+    Returns:
+        levels [dict]: step to volume dict, step 1 being `vol` itself, levels
+            that can't be written (read-only data directory) are left out
+    """
+    levels = {1: vol}
+    for step in steps:
+        path = pyramid_path(vol['path'], step)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(vol['path']):
+            try:
+                _write_level(vol['data'], path, step, slab)
+            except OSError:
+                # read-only data directory, sections are read from the finer levels
+                continue
+        levels[step] = open_volume(path)
+    return levels
+
+
+def _write_level(data, path, step, slab):
+    """Write `data` decimated by `step` to `path`, through a temporary file"""
+    shape = tuple(-(-n // step) for n in data.shape)
+    tmp = path[:-len('.npy')] + '.tmp.npy'
+    try:
+        out = open_memmap(tmp, mode='w+', dtype=np.float32, shape=shape)
+        for i0 in range(0, shape[0], slab):
+            # strided reads, only every step-th inline is touched
+            out[i0:i0 + slab] = data[i0 * step:(i0 + slab) * step:step, ::step, ::step]
+        out.flush()
+        del out
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def full_shape(shape, kind):
+    """Shape of a full resolution section as shown, see `seismic_volume.section`"""
+    ni, nx, nt = shape
+    return {'inline': (nt, nx), 'xline': (nt, ni), 'timeslice': (ni, nx)}[kind]
+
+
+class SliceService:
+    """Sections of a volume at a chosen level of detail, with an LRU cache
+    Args:
+        vol [dict]: volume from `seismic_volume.open_volume`
+        cache_size [int]: number of sections kept
+        steps [tuple]: decimation factors of the pyramid, () for none
+    """
+    def __init__(self, vol, cache_size=64, steps=STEPS):
+        self.vol = vol
+        self.shape = vol['shape']
+        self.levels = build_pyramid(vol, steps) if steps else {1: vol}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def step_for(self, kind, pixels):
+        """Coarsest decimation that still has at least `pixels` (height, width) samples"""
+        height, width = full_shape(self.shape, kind)
+        best = 1
+        for step in sorted(self.levels):
+            if -(-height // step) >= pixels[0] and -(-width // step) >= pixels[1]:
+                best = step
+        return best
+
+    @staticmethod
+    def key(kind, index, step=1):
+        """Cache key of a section, full resolution indices showing the same decimated section share it"""
+        return kind, index // step, step
+
+    def cached(self, kind, index, step=1):
+        """Section from the cache, None if not there"""
+        key = self.key(kind, index, step)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        return None
+
+    def store(self, kind, index, step, amp):
+        with self.lock:
+            self.cache[self.key(kind, index, step)] = amp
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def read(self, kind, index, step=1):
+        """Section from disk, bypassing the cache"""
+        if kind not in SECTIONS:
+            raise ValueError(f'`kind` must be one of {SECTIONS}')
+        return section(self.levels[step], kind, index // step)
+
+    def get(self, kind, index, step=1):
+        """Section `index` of `kind`, decimated by `step`
+        Args:
+            kind [str]: 'inline', 'xline' or 'timeslice'
+            index [int]: full resolution inline, xline or sample number
+            step [int]: 1 for full resolution or a pyramid level
+        Returns:
+            amp [array]: 2D amplitudes oriented like `seismic_volume.section`
+        """
+        amp = self.cached(kind, index, step)
+        with self.lock:
+            self.stats['hits' if amp is not None else 'misses'] += 1
+        if amp is None:
+            amp = self.read(kind, index, step)
+            self.store(kind, index, step, amp)
+        return amp
+
+
+class Prefetcher:
+    """Speculatively load the sections next to the one being viewed
+    Wraps a `SliceService`, with the same `get`, and after each request
+    queues the next `k` sections in the direction of travel (both ways until
+    there is one) on a thread pool, into the service's cache. Changing the
+    kind of section cancels whatever is still queued.
+    Args:
+        service [SliceService]: sections and their cache, keep its
+            `cache_size` well above `2 * k`
+        k [int]: sections loaded ahead
+        workers [int]: loading threads
+    """
+    def __init__(self, service, k=4, workers=2):
+        self.service = service
+        self.k = k
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.prefetched = set()
+        self.lock = threading.Lock()
+        self.kind = None
+        self.last = None
+        self.direction = 0
+        self.generation = 0
+        self.stats = {'requests': 0, 'prefetch_hits': 0, 'late_hits': 0, 'cache_hits': 0, 'misses': 0,
+                      'prefetched': 0, 'cancelled': 0}
+
+    def __getattr__(self, name):
+        # `levels`, `shape`, `step_for`... come from the wrapped service
+        return getattr(self.service, name)
+
+    @property
+    def hit_rate(self):
+        """Share of requests already loaded by the prefetcher when asked for, to tune `k`"""
+        return self.stats['prefetch_hits'] / max(self.stats['requests'], 1)
+
+    def _load(self, key, generation):
+        if generation != self.generation:
+            return None
+        kind, i, step = key
+        amp = self.service.read(kind, i * step, step)
+        self.service.store(kind, i * step, step, amp)
+        with self.lock:
+            self.prefetched.add(key)
+            self.pending.pop(key, None)
+            self.stats['prefetched'] += 1
+        return amp
+
+    def cancel(self):
+        """Drop the queued loads, those already running finish into the cache"""
+        with self.lock:
+            for future in self.pending.values():
+                if future.cancel():
+                    self.stats['cancelled'] += 1
+            self.pending.clear()
+            self.generation += 1
+
+    def schedule(self, kind, index, step=1):
+        """Queue the `k` neighbours of a section in the direction of travel"""
+        # neighbours at this level of detail, not full resolution indices
+        n = -(-self.service.shape[SECTIONS.index(kind)] // step)
+        directions = [self.direction] if self.direction else [1, -1]
+        for j in range(1, self.k + 1):
+            for direction in directions:
+                i = index // step + direction * j
+                key = (kind, i, step)
+                if not 0 <= i < n or self.service.cached(kind, i * step, step) is not None:
+                    continue
+                with self.lock:
+                    if key not in self.pending:
+                        self.pending[key] = self.pool.submit(self._load, key, self.generation)
+
+    def get(self, kind, index, step=1):
+        """Section `index` of `kind`, see `SliceService.get`, then prefetch its neighbours"""
+        if kind != self.kind:
+            self.cancel()
+            self.kind, self.last, self.direction = kind, None, 0
+        elif self.last is not None and index != self.last:
+            self.direction = 1 if index > self.last else -1
+        self.last = index
+
+        key = self.service.key(kind, index, step)
+        amp = self.service.cached(kind, index, step)
+        with self.lock:
+            self.stats['requests'] += 1
+            future = self.pending.get(key)
+            if amp is not None:
+                self.stats['prefetch_hits' if key in self.prefetched else 'cache_hits'] += 1
+            self.prefetched.discard(key)
+        if amp is None and future is not None and not future.cancelled():
+            # on its way, wait for it rather than reading it twice
+            amp = future.result()
+            with self.lock:
+                self.stats['late_hits'] += 1
+        if amp is None:
+            with self.lock:
+                self.stats['misses'] += 1
+            amp = self.service.read(kind, index, step)
+            self.service.store(kind, index, step, amp)
+        self.schedule(kind, index, step)
+        return amp
+
+    def close(self):
+        self.cancel()
+        self.pool.shutdown(wait=False)
+
+
+class SliceView:
+    """One figure whose image, crosshair and title are updated in place
+    Args:
+        service [SliceService or Prefetcher]: where sections come from
+        clip [float]: amplitudes shown between -clip and +clip
+        figsize [tuple]: figure size [inches]
+        aspect [float]: image aspect ratio
+        cmap [str]: initial colormap
+        shrink [float]: colorbar size relative to the axes
+    """
+    def __init__(self, service, clip, figsize=(18, 6), aspect=0.5, cmap='Greys', shrink=0.6):
+        import matplotlib.pyplot as plt
+
+        self.service = service
+        self.fig, self.ax = plt.subplots(figsize=figsize, ncols=1)
+        self.im = self.ax.imshow(np.zeros((2, 2)), aspect=aspect, vmin=-clip, vmax=clip, cmap=cmap,
+                                 interpolation='nearest')
+        self.cbar = self.fig.colorbar(self.im, ax=self.ax, shrink=shrink)
+        self.hline = self.ax.axhline(y=0, linewidth=2)
+        self.vline = self.ax.axvline(x=0, linewidth=2)
+        for axis in ['top', 'bottom', 'left', 'right']:
+            self.ax.spines[axis].set_linewidth(2)
+
+    def pixels(self):
+        """Size of the axes on screen, (height, width) [pixels]"""
+        box = self.ax.get_window_extent()
+        return int(box.height), int(box.width)
+
+    def update(self, kind, index, hline=None, vline=None, colors=('b', 'g', 'r'), cmap=None, title=None,
+               draft=False):
+        """Show a section, at the level of detail the axes can display
+        Args:
+            kind [str]: 'inline', 'xline' or 'timeslice'
+            index [int]: inline, xline or sample number
+            hline, vline [int]: crosshair positions, full resolution
+            colors [tuple]: colors of the horizontal line, vertical line and spines
+            cmap [str]: colormap, unchanged if None
+            title [str]: axes title
+            draft [bool]: show the coarsest level, e.g. while scrubbing
+        Returns:
+            step [int]: decimation of the section shown
+        """
+        service = self.service
+        step = max(service.levels) if draft else service.step_for(kind, self.pixels())
+        amp = service.get(kind, index, step)
+        height, width = full_shape(service.shape, kind)
+        self.im.set_data(amp)
+        # decimated levels are stretched over full resolution coordinates
+        self.im.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+        if cmap is not None:
+            self.im.set_cmap(cmap)
+            self.cbar.set_label(cmap)
+        if hline is not None:
+            self.hline.set_ydata([hline, hline])
+        if vline is not None:
+            self.vline.set_xdata([vline, vline])
+        self.hline.set_color(colors[0])
+        self.vline.set_color(colors[1])
+        for spine in self.ax.spines.values():
+            spine.set_color(colors[2])
+        if title is not None:
+            self.ax.set_title(title)
+        self.fig.canvas.draw_idle()
+        return step
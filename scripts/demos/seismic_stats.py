@@ -0,0 +1,201 @@
+"""Amplitude statistics sidecar for seismic volumes
+
+One streaming pass over a volume, a slab of inlines at a time, gives:
+
+- min, max, mean, RMS and standard deviation of the whole volume
+- a fixed-size amplitude histogram, so any percentile (clip level) can be
+  read off it approximately, to within one bin width
+- min, max and RMS of every cubic brick, for local gain
+
+The result is kept next to the cube as `<cube>.stats.json` and rebuilt
+only when the cube changes, so clip levels are instant after the first use.
+"""
+import os
+import json
+
+import numpy as np
+
+BRICK = 64
+N_BINS = 4096
+PERCENTILES = (1, 2, 5, 10, 50, 90, 95, 98, 99)
+
+
+def stats_path(path):
+    """Sidecar filename of a cube"""
+    return path + '.stats.json'
+
+
+def new_hist(n_bins=N_BINS):
+    """Empty amplitude histogram, `n_bins` bins of `width` symmetric about zero
+    The width is set by the first values and doubled whenever later values
+    fall outside, so one pass needs no prior knowledge of the amplitude range.
+    """
+    if n_bins % 4:
+        raise ValueError('`n_bins` must be a multiple of 4')
+    return {'width': 0., 'counts': np.zeros(n_bins, dtype=np.int64)}
+
+
+def update_hist(h, values):
+    """Add amplitudes to a histogram from `new_hist`"""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return h
+    n_bins = h['counts'].size
+    half = n_bins // 2
+    peak = np.abs(values).max()
+    if h['width'] == 0:
+        h['width'] = peak / (half - 1) if peak > 0 else 1.
+    while peak >= half * h['width']:
+        # merge pairs of bins, the histogram keeps centred on zero
+        merged = np.zeros_like(h['counts'])
+        merged[n_bins // 4:3 * n_bins // 4] = h['counts'].reshape(-1, 2).sum(axis=1)
+        h['counts'] = merged
+        h['width'] *= 2
+    idx = np.floor(values / h['width']).astype(np.int64) + half
+    h['counts'] += np.bincount(idx, minlength=n_bins)
+    return h
+
+
+def hist_percentile(h, q):
+    """Percentile(s) q in [0, 100], interpolated linearly within a bin"""
+    q = np.asarray(q, dtype=float)
+    cum = np.cumsum(h['counts'])
+    target = q / 100 * cum[-1]
+    i = np.clip(np.searchsorted(cum, target, side='left'), 0, cum.size - 1)
+    before = np.where(i > 0, cum[i - 1], 0)
+    inside = np.where(h['counts'][i] > 0, (target - before) / np.maximum(h['counts'][i], 1), 0)
+    return (i - cum.size // 2 + inside) * h['width']
+
+
+def compute_stats(vol, brick=BRICK, n_bins=N_BINS):
+    """Statistics of a volume in one streaming pass
+    Args:
+        vol [dict]: volume from `seismic_volume.open_volume`
+        brick [int]: brick edge length [samples]
+        n_bins [int]: histogram size
+    Returns:
+        stats [dict]: JSON-ready, see the module docstring
+    """
+    data = vol['data']
+    ni, nx, nt = data.shape
+    x_starts = np.arange(0, nx, brick)
+    t_starts = np.arange(0, nt, brick)
+    h = new_hist(n_bins)
+    n, total, total_sq = 0, 0., 0.
+    lo, hi = np.inf, -np.inf
+    b_min, b_max, b_rms = [], [], []
+    for i0 in range(0, ni, brick):
+        # one brick thick slab of inlines, a contiguous read
+        slab = np.asarray(data[i0:i0 + brick], dtype=np.float64)
+        update_hist(h, slab)
+        n += slab.size
+        total += slab.sum()
+        total_sq += np.square(slab).sum()
+        lo, hi = min(lo, slab.min()), max(hi, slab.max())
+
+        # reduce the slab to its row of bricks
+        bmin = np.minimum.reduceat(np.minimum.reduceat(slab.min(axis=0), x_starts, axis=0), t_starts, axis=1)
+        bmax = np.maximum.reduceat(np.maximum.reduceat(slab.max(axis=0), x_starts, axis=0), t_starts, axis=1)
+        bsq = np.add.reduceat(np.add.reduceat(np.square(slab).sum(axis=0), x_starts, axis=0), t_starts, axis=1)
+        sizes = np.outer(np.diff(np.append(x_starts, nx)), np.diff(np.append(t_starts, nt))) * slab.shape[0]
+        b_min.append(bmin)
+        b_max.append(bmax)
+        b_rms.append(np.sqrt(bsq / sizes))
+
+    mean = total / n
+    return {'shape': list(data.shape),
+            'brick': brick,
+            'n': n,
+            'min': float(lo),
+            'max': float(hi),
+            'mean': mean,
+            'rms': float(np.sqrt(total_sq / n)),
+            'std': float(np.sqrt(max(total_sq / n - mean ** 2, 0))),
+            'percentiles': {str(p): float(v) for p, v in zip(PERCENTILES, np.clip(hist_percentile(h, PERCENTILES), lo, hi))},
+            'hist': {'width': h['width'], 'counts': h['counts'].tolist()},
+            'bricks': {'min': np.array(b_min).tolist(),
+                       'max': np.array(b_max).tolist(),
+                       'rms': np.array(b_rms).tolist(),
+                       },
+            }
+
+
+def _source_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def save_stats(stats, path):
+    """Write the sidecar of cube `path` atomically"""
+    tmp = stats_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp, stats_path(path))
+
+
+def load_stats(vol, brick=BRICK):
+    """Statistics of a volume from its sidecar, (re)built if missing or stale
+    Args:
+        vol [dict]: volume from `seismic_volume.open_volume`
+        brick [int]: brick edge length used when building
+    Returns:
+        stats [dict], with `hist` and `bricks` as arrays
+    """
+    if 'stats' in vol:
+        return vol['stats']
+    path = vol['path']
+    try:
+        with open(stats_path(path)) as f:
+            stats = json.load(f)
+        if stats.get('source') != _source_key(path) or stats['shape'] != list(vol['shape']):
+            stats = None
+    except (FileNotFoundError, ValueError, KeyError):
+        stats = None
+    if stats is None:
+        stats = compute_stats(vol, brick)
+        stats['source'] = _source_key(path)
+        try:
+            save_stats(stats, path)
+        except OSError:
+            # read-only data directory, keep the stats for this session only
+            pass
+    stats['hist']['counts'] = np.asarray(stats['hist']['counts'], dtype=np.int64)
+    stats['bricks'] = {k: np.asarray(v) for k, v in stats['bricks'].items()}
+    vol['stats'] = stats
+    return stats
+
+
+def percentile(stats, q):
+    """Approximate amplitude percentile q in [0, 100] of the whole volume"""
+    if str(q) in stats['percentiles']:
+        return stats['percentiles'][str(q)]
+    return float(np.clip(hist_percentile(stats['hist'], q), stats['min'], stats['max']))
+
+
+def brick_stats(stats, inline, xline, sample):
+    """min, max and RMS of the brick holding a given sample"""
+    b = stats['brick']
+    ijk = (inline // b, xline // b, sample // b)
+    return {k: float(v[ijk]) for k, v in stats['bricks'].items()}
+
+
+def section_gain(stats, kind, index, key='rms'):
+    """Per-brick values along a section, for local gain
+    Args:
+        stats [dict]: from `load_stats`
+        kind [str]: 'inline', 'xline' or 'timeslice'
+        index [int]: inline, xline or sample number
+        key [str]: 'min', 'max' or 'rms'
+    Returns:
+        grid [array]: one value per brick, oriented like `seismic_volume.section`
+    """
+    bricks = stats['bricks'][key]
+    b = index // stats['brick']
+    if kind == 'inline':
+        return bricks[b, :, :].T
+    elif kind == 'xline':
+        return bricks[:, b, :].T
+    elif kind == 'timeslice':
+        return bricks[:, :, b]
+    raise ValueError("`kind` must be one of 'inline', 'xline', 'timeslice'")
@@ -0,0 +1,80 @@
+"""Seismic volume backend for `plotter.seismic_plotter`
+
+A volume is opened once and kept: the `.npy` cube is memory-mapped, so an
+inline, xline or timeslice read only pulls the pages it needs from disk
+instead of loading the whole cube on every widget interaction.
+
+Cubes converted to bricks by `seismic_bricks.py` are opened the same way,
+from their directory, and then timeslices are as cheap to read as inlines.
+
+Volumes are plain dicts, see `open_volume`, and sections are read with
+`section`, already oriented the way the plotter shows them.
+"""
+import os
+
+import numpy as np
+
+import seismic_stats
+
+SECTIONS = ('inline', 'xline', 'timeslice')
+# volumes opened so far, by path
+_VOLUMES = {}
+
+
+def open_volume(path):
+    """Memory-map a seismic cube
+    Args:
+        path [str]: `.npy` file of shape (n_inlines, n_xlines, n_samples),
+            or a bricked cube directory
+    Returns:
+        vol [dict]: the memory-mapped (or bricked) `data`, its `shape` and `path`
+    """
+    if os.path.isdir(path):
+        import seismic_bricks
+        return seismic_bricks.open_bricks(path)
+    data = np.load(path, mmap_mode='r')
+    if data.ndim != 3:
+        raise ValueError(f'{path} is not a 3D volume, shape {data.shape}')
+    return {'path': path, 'data': data, 'shape': data.shape}
+
+
+def get_volume(path):
+    """`open_volume`, once per path per session"""
+    if path not in _VOLUMES:
+        _VOLUMES[path] = open_volume(path)
+    return _VOLUMES[path]
+
+
+def section(vol, kind, index):
+    """Read one section of a volume
+    Args:
+        vol [dict]: volume from `open_volume`
+        kind [str]: one of `SECTIONS`
+        index [int]: inline, xline or sample number
+    Returns:
+        amp [array]: 2D amplitudes, samples down for inlines and xlines
+    """
+    data = vol['data']
+    if kind == 'inline':
+        amp = data[index, :, :].T
+    elif kind == 'xline':
+        amp = data[:, index, :].T
+    elif kind == 'timeslice':
+        amp = data[:, :, index]
+    else:
+        raise ValueError(f'`kind` must be one of {SECTIONS}')
+    # copy out of the memory map, reading only the pages (or bricks) of this section
+    return np.array(amp)
+
+
+def clip_level(vol, percentile=98):
+    """Amplitude clip level, read off the statistics sidecar
+    The sidecar is built by a single streaming pass the first time a cube
+    is used and reused afterwards, see `seismic_stats`.
+    Args:
+        vol [dict]: volume from `open_volume`
+        percentile [float]: percentile of the amplitudes
+    Returns:
+        clip [float]
+    """
+    return seismic_stats.percentile(seismic_stats.load_stats(vol), percentile)
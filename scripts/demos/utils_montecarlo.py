@@ -0,0 +1,270 @@
+"""Monte Carlo volumetrics on top of `utils_volumes`
+
+Inputs of `calc_grv` / `calc_hciip` are given either as single values or as
+distributions, optionally rank-correlated (Iman-Conover). Samples are drawn
+and evaluated in vectorized blocks with `calc_grv_batch` / `calc_hciip_batch`,
+and only streaming histograms are kept, so 10^8 trials need no more memory
+than one block. Blocks can be spread over a process pool; every block has
+its own seed spawned from one `SeedSequence`, so results only depend on the
+seed, not on the number of processes.
+
+Percentiles follow the reserves convention: P90 is the value exceeded with
+90% probability, i.e. the 10th percentile.
+
+Example:
+
+    import utils_montecarlo as mc
+    res = mc.simulate(thickness=mc.triangular(20, 35, 60),
+                      height=120,
+                      area=mc.lognormal(1500, 400),
+                      phi=mc.truncnormal(0.2, 0.04, 0.05, 0.35),
+                      NTG=mc.triangular(0.5, 0.7, 0.9),
+                      Sw=mc.triangular(0.15, 0.3, 0.45),
+                      FVF=1.2, top='round', fluid='oil',
+                      correlations={('phi', 'Sw'): -0.6},
+                      n=10**8, processes=8, seed=42)
+    res['hciip']['P90'], res['hciip']['P50'], res['hciip']['P10']
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils_volumes import TOP_CODES, FLUID_CODES, encode, calc_grv_batch, calc_hciip_batch
+
+# sampled inputs of `simulate`, in order
+INPUTS = ('thickness', 'height', 'area', 'g', 'phi', 'NTG', 'Sw', 'FVF')
+BLOCK = 1_000_000
+# log10 bin width of the result histograms, about 0.1% relative resolution
+LOG_WIDTH = 5e-4
+
+
+def triangular(low, mode, high):
+    """Triangular distribution between `low` and `high`, peaking at `mode`"""
+    return {'dist': 'triangular', 'low': low, 'mode': mode, 'high': high}
+
+
+def lognormal(mean, sd):
+    """Lognormal distribution of given arithmetic mean and standard deviation"""
+    return {'dist': 'lognormal', 'mean': mean, 'sd': sd}
+
+
+def truncnormal(mean, sd, low=-np.inf, high=np.inf):
+    """Normal distribution truncated to [`low`, `high`]"""
+    return {'dist': 'truncnormal', 'mean': mean, 'sd': sd, 'low': low, 'high': high}
+
+
+def sample(spec, size, rng):
+    """Draw `size` samples of one input
+    Args:
+        spec: single value, or dict from `triangular`, `lognormal` or `truncnormal`
+        size [int]: number of samples
+        rng [np.random.Generator]: random generator
+    Returns:
+        samples [array]
+    """
+    if not isinstance(spec, dict):
+        return np.full(size, spec, dtype=float)
+    if spec['dist'] == 'triangular':
+        return rng.triangular(spec['low'], spec['mode'], spec['high'], size)
+    if spec['dist'] == 'lognormal':
+        sigma2 = np.log(1 + (spec['sd'] / spec['mean']) ** 2)
+        return rng.lognormal(np.log(spec['mean']) - sigma2 / 2, np.sqrt(sigma2), size)
+    if spec['dist'] == 'truncnormal':
+        # rejection sampling, vectorized, redrawing only what fell outside
+        out = rng.normal(spec['mean'], spec['sd'], size)
+        bad = np.flatnonzero((out < spec['low']) | (out > spec['high']))
+        for _ in range(1000):
+            if bad.size == 0:
+                return out
+            out[bad] = rng.normal(spec['mean'], spec['sd'], bad.size)
+            bad = bad[(out[bad] < spec['low']) | (out[bad] > spec['high'])]
+        raise ValueError(f'truncation range of {spec} holds too little probability to sample')
+    raise ValueError(f"unknown distribution {spec['dist']!r}")
+
+
+def rank_correlation_matrix(names, correlations):
+    """Target rank correlation matrix of the sampled inputs
+    Args:
+        names [list]: sampled input names, in column order
+        correlations [dict]: `(name, name)` to rank correlation coefficient
+    Returns:
+        C [array]: symmetric, positive definite correlation matrix
+    """
+    C = np.eye(len(names))
+    for (a, b), rho in correlations.items():
+        if a not in names or b not in names:
+            raise ValueError(f'can only correlate sampled inputs, not {a!r} and {b!r}')
+        C[names.index(a), names.index(b)] = C[names.index(b), names.index(a)] = rho
+    np.linalg.cholesky(C)  # raises LinAlgError if the coefficients are inconsistent
+    return C
+
+
+def iman_conover(X, C, rng):
+    """Reorder the columns of X so their rank correlation approaches C
+    The marginal distributions are untouched, only the pairing of samples changes.
+    Args:
+        X [array]: (n, k) independent samples
+        C [array]: (k, k) target rank correlation
+        rng [np.random.Generator]: random generator
+    Returns:
+        X reordered, (n, k)
+    References:
+        Iman, R. L. and Conover, W. J. (1982), A distribution-free approach to
+        inducing rank correlation among input variables
+    """
+    n, k = X.shape
+    scores = rng.standard_normal((n, k))
+    # remove the chance correlation of the scores, then impose C
+    E = np.corrcoef(scores, rowvar=False)
+    T = scores @ np.linalg.inv(np.linalg.cholesky(E)).T @ np.linalg.cholesky(C).T
+    out = np.empty_like(X)
+    for j in range(k):
+        ranks = np.argsort(np.argsort(T[:, j]))
+        out[:, j] = np.sort(X[:, j])[ranks]
+    return out
+
+
+def new_hist(width=LOG_WIDTH):
+    """Empty streaming histogram of positive results, binned on log10
+    Grows to whatever range the values cover, values <= 0 are only counted.
+    """
+    return {'width': width, 'origin': 0, 'counts': np.zeros(0, dtype=np.int64),
+            'n': 0, 'zeros': 0, 'sum': 0., 'min': np.inf, 'max': -np.inf}
+
+
+def update_hist(h, values):
+    """Add results to a histogram from `new_hist`"""
+    values = np.asarray(values, dtype=float).ravel()
+    h['n'] += values.size
+    h['sum'] += values.sum()
+    h['min'] = min(h['min'], values.min())
+    h['max'] = max(h['max'], values.max())
+    positive = values[values > 0]
+    h['zeros'] += values.size - positive.size
+    if positive.size:
+        idx = np.floor(np.log10(positive) / h['width']).astype(np.int64)
+        _add_counts(h, idx.min(), np.bincount(idx - idx.min()))
+    return h
+
+
+def _add_counts(h, origin, counts):
+    """Add `counts` starting at bin `origin` to `h`, growing it as needed"""
+    if h['counts'].size == 0:
+        h['origin'], h['counts'] = origin, counts.astype(np.int64)
+        return
+    lo = min(h['origin'], origin)
+    hi = max(h['origin'] + h['counts'].size, origin + counts.size)
+    merged = np.zeros(hi - lo, dtype=np.int64)
+    merged[h['origin'] - lo:h['origin'] - lo + h['counts'].size] += h['counts']
+    merged[origin - lo:origin - lo + counts.size] += counts
+    h['origin'], h['counts'] = lo, merged
+
+
+def merge_hist(h, other):
+    """Add histogram `other` into `h`, e.g. results of another process"""
+    if other['counts'].size:
+        _add_counts(h, other['origin'], other['counts'])
+    for key in ('n', 'zeros', 'sum'):
+        h[key] += other[key]
+    h['min'] = min(h['min'], other['min'])
+    h['max'] = max(h['max'], other['max'])
+    return h
+
+
+def percentile(h, q):
+    """Percentile(s) q in [0, 100] of the results, geometric interpolation within a bin
+    NaN for an empty histogram.
+    """
+    q = np.asarray(q, dtype=float)
+    if h['n'] == 0:
+        return np.full(q.shape, np.nan)
+    if h['counts'].size == 0:
+        # only results <= 0, reported as 0 like below
+        return np.clip(np.zeros(q.shape), h['min'], h['max'])
+    target = q / 100 * h['n'] - h['zeros']
+    cum = np.cumsum(h['counts'])
+    i = np.clip(np.searchsorted(cum, target, side='left'), 0, cum.size - 1)
+    before = np.where(i > 0, cum[i - 1], 0)
+    inside = (target - before) / np.maximum(h['counts'][i], 1)
+    value = 10 ** ((h['origin'] + i + np.clip(inside, 0, 1)) * h['width'])
+    return np.clip(np.where(target <= 0, 0., value), h['min'], h['max'])
+
+
+def summary(h):
+    """Mean, min, max and the P90 / P50 / P10 of a result histogram, NaN if it is empty"""
+    p90, p50, p10 = percentile(h, [10, 50, 90])
+    return {'n': h['n'], 'mean': h['sum'] / h['n'] if h['n'] else np.nan, 'min': h['min'], 'max': h['max'],
+            'P90': float(p90), 'P50': float(p50), 'P10': float(p10), 'hist': h}
+
+
+def histogram(h, bins=50, log=True):
+    """Result counts rebinned for plotting
+    Args:
+        h [dict]: histogram from `new_hist`
+        bins [int]: number of bins between the smallest and largest positive result
+        log [bool]: logarithmic bins
+    Returns:
+        counts, edges, both empty if there are no positive results
+    """
+    if h['counts'].size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    centres = 10 ** ((h['origin'] + np.arange(h['counts'].size) + 0.5) * h['width'])
+    lo, hi = centres[0], centres[-1]
+    edges = np.geomspace(lo, hi, bins + 1) if log else np.linspace(lo, hi, bins + 1)
+    return np.histogram(centres, bins=edges, weights=h['counts'])[0], edges
+
+
+def _run_block(args):
+    """Sample and evaluate one block, returns the GRV and HCIIP histograms"""
+    inputs, top, fluid, C, size, seed = args
+    rng = np.random.default_rng(seed)
+    names = [name for name in INPUTS if isinstance(inputs[name], dict)]
+    X = np.column_stack([sample(inputs[name], size, rng) for name in names]) if names else np.empty((size, 0))
+    if C is not None:
+        X = iman_conover(X, C, rng)
+    values = {name: X[:, names.index(name)] if name in names else inputs[name] for name in INPUTS}
+    grv, _ = calc_grv_batch(values['thickness'], values['height'], values['area'], top=top, g=values['g'])
+    hciip = calc_hciip_batch(grv, values['phi'], values['NTG'], values['Sw'], values['FVF'], fluid=fluid)
+    return (update_hist(new_hist(), np.broadcast_to(grv, (size,))),
+            update_hist(new_hist(), np.broadcast_to(hciip, (size,))))
+
+
+def simulate(thickness, height, area, phi=1, NTG=1, Sw=0, FVF=1, top='slab', fluid='oil', g=0,
+             correlations=None, n=BLOCK, block=BLOCK, processes=1, seed=None):
+    """Probabilistic GRV and HCIIP
+    Args:
+        thickness, height, area, g, phi, NTG, Sw, FVF: single values or distributions
+            from `triangular`, `lognormal`, `truncnormal`, see `calc_grv` and `calc_hciip`
+        top [str]: structure shape, one of `TOP_CODES`
+        fluid [str]: one of `FLUID_CODES`
+        correlations [dict]: `(name, name)` to rank correlation, e.g. `{('phi', 'Sw'): -0.5}`
+        n [int]: number of trials
+        block [int]: trials sampled at a time, bounds memory use
+        processes [int]: worker processes, 1 to run in this process
+        seed [int]: seed of the `SeedSequence` the block seeds are spawned from
+    Returns:
+        results [dict]: `'grv'` and `'hciip'` summaries, see `summary`
+    """
+    inputs = {'thickness': thickness, 'height': height, 'area': area, 'g': g,
+              'phi': phi, 'NTG': NTG, 'Sw': Sw, 'FVF': FVF}
+    names = [name for name in INPUTS if isinstance(inputs[name], dict)]
+    C = rank_correlation_matrix(names, correlations) if correlations else None
+    top, fluid = encode(top, TOP_CODES, default=TOP_CODES['slab']), encode(fluid, FLUID_CODES)
+
+    sizes = [block] * (n // block) + ([n % block] if n % block else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(inputs, top, fluid, C, size, s) for size, s in zip(sizes, seeds)]
+    grv, hciip = new_hist(), new_hist()
+    if processes == 1:
+        results = map(_run_block, jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes)
+        results = pool.map(_run_block, jobs)
+    try:
+        for h_grv, h_hciip in results:
+            merge_hist(grv, h_grv)
+            merge_hist(hciip, h_hciip)
+    finally:
+        if processes != 1:
+            pool.shutdown()
+    return {'grv': summary(grv), 'hciip': summary(hciip)}
@@ -1,5 +1,13 @@
 import numpy as np
 
+# integer codes of the categorical inputs, for the `_batch` functions
+TOP_CODES = {'slab': 0, 'round': 1, 'flat': 2}
+FLUID_CODES = {'oil': 0, 'gas': 1}
+# slope of the geometric correction factor against thickness / height, by top code
+TOP_SLOPES = np.array([0., -0.6, -0.3])
+# conversion factor from acre-ft to bbl (oil) or ft3 (gas), by fluid code
+FLUID_CONSTANTS = np.array([7758, 43560])
+
 def check_contours(contour):
     """Check that contour is an array of two vectors for x and y
     Args:
@@ -69,6 +77,85 @@ def calc_hciip(GRV, phi=1, NTG=1, Sw=0, FVF=1, fluid='oil'):
     return (constant * GRV * phi * NTG * (1 - Sw)) / FVF
 
 
+def encode(values, codes, default=None):
+    """Integer codes of a categorical input
+    Args:
+        values: string, integer codes, or array-like / `pd.Categorical` of either
+        codes [dict]: category to code, e.g. `TOP_CODES`
+        default [int]: code of unknown categories, raise `ValueError` if None
+    Returns:
+        integer code array
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values
+    uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+    lookup = []
+    for u in uniques:
+        if u not in codes and default is None:
+            raise ValueError(f"unknown category {str(u)!r}, must be of `{set(codes)}`")
+        lookup.append(codes.get(u, default))
+    return np.array(lookup, dtype=np.int64)[inverse].reshape(values.shape)
+
+
+def calc_grv_batch(thickness, height, area, top=0, g=None):
+    """Vectorized `calc_grv` over a portfolio of prospects
+    Args:
+        thickness [array-like]: average thickness of reservoir
+        height [array-like]: height of hydrocarbon column
+        area [array-like]: area of hydrocarbon prospect
+        top [array-like]: `TOP_CODES` codes or names, unknown names count as 'slab' like `calc_grv`
+        g [array-like]: geometric correction factors, 0 where it should be calculated, None for all
+    Returns:
+        grv, g arrays broadcast together, identical to `calc_grv` prospect by prospect
+    """
+    thickness, height, area = np.asarray(thickness), np.asarray(height), np.asarray(area)
+    top = encode(top, TOP_CODES, default=TOP_CODES['slab'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = thickness / height
+        g_calc = np.where(top == TOP_CODES['slab'], 1., TOP_SLOPES[top] * ratio + 1)
+    if g is not None:
+        g = np.asarray(g, dtype=float)
+        g_calc = np.where(g != 0, g, g_calc)
+    return thickness * area * g_calc, g_calc
+
+
+def calc_hciip_batch(GRV, phi=1, NTG=1, Sw=0, FVF=1, fluid=0):
+    """Vectorized `calc_hciip` over a portfolio of prospects
+    Args:
+        GRV [array-like]: gross rock volume [acre-feet]
+        phi, NTG, Sw, FVF [array-like]: as for `calc_hciip`
+        fluid [array-like]: `FLUID_CODES` codes or names
+    Return:
+        HCIIP [array]: broadcast over the inputs, identical to `calc_hciip` prospect by prospect
+    """
+    fluid = encode(fluid, FLUID_CODES)
+    if fluid.size and (fluid.min() < 0 or fluid.max() >= len(FLUID_CONSTANTS)):
+        raise ValueError(f'`fluid` codes must be of `{set(FLUID_CODES.values())}`')
+    constant = FLUID_CONSTANTS[fluid]
+    return (constant * np.asarray(GRV) * phi * NTG * (1 - np.asarray(Sw))) / FVF
+
+
+def calc_portfolio(prospects):
+    """GRV and HCIIP of every prospect in a table, in one pass
+    Args:
+        prospects [pd.DataFrame]: one row per prospect with columns `thickness`, `height`,
+            `area` and optionally `top`, `g`, `phi`, `NTG`, `Sw`, `FVF`, `fluid`,
+            missing ones take the defaults of `calc_grv` and `calc_hciip`
+    Returns:
+        copy of `prospects` with `grv`, `g` and `hciip` columns
+    """
+    out = prospects.copy()
+    grv, g = calc_grv_batch(out['thickness'], out['height'], out['area'],
+                            top=out['top'] if 'top' in out else 0,
+                            g=out['g'].fillna(0) if 'g' in out else None)
+    out['grv'], out['g'] = grv, g
+    defaults = {'phi': 1, 'NTG': 1, 'Sw': 0, 'FVF': 1, 'fluid': 0}
+    kwargs = {k: out[k].to_numpy() if k in out else v for k, v in defaults.items()}
+    out['hciip'] = calc_hciip_batch(grv, **kwargs)
+    return out
+
+
 def poly_area(x,y):
     """Implementation of Shoelace formula
     Args:
@@ -1,50 +1,54 @@
 import sys
+import time
+import queue
+import threading
 from distutils.util import strtobool
 from datetime import date
 import smtplib
-from email.message import EmailMessage
+from email.message import EmailMessage, MIMEPart
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 import numpy as np
 import pandas as pd
 from enviro import GMAIL_LOGIN, GMAIL_PWD, MESSAGE_how_to, MESSAGE_solution, PROJECT_PATH
+from kata_tracking import (get_notebooks_to_send, notebook_columns,
+                           journal_sent, replay_journal, compact_journal)
 
 
 PATH = PROJECT_PATH
 
 
-def get_notebook_to_send(row, df, PATH):
-    """Find the first empty column and return dict of some row values.
+def get_attachment(challenge, path, attachments=None):
+    """Read and MIME-encode a notebook, once per run when given a cache.
     Args
     ----
-        row: pandas.core.series.Series
-        df:  pandas.core.frame.DataFrame
-        PATH: str, path to notebooks
+        challenge: str, challenge filename
+        path: str, path to notebooks
+        attachments: dict, cache of encoded notebooks filled as they are read
     Returns
     -------
-        d: dict, dictionary of data for given row at first empty column
+        part: email.message.MIMEPart, the notebook as a base64 attachment
     """
-    for idx, col in enumerate(row):
-        try:
-            # find columns (challenges) that have not been sent yet
-            if np.isnan(col):
-                d = {'name': row.recipient,
-                     'email': row.email,
-                     'challenge': df.columns[idx],
-                     'challenge_path': PATH + df.columns[idx],
-                    }
-                return d
-        except TypeError:
-            continue
+    if attachments is not None and (path, challenge) in attachments:
+        return attachments[(path, challenge)]
+    # read the jupyter notebook
+    with open(f'{path}{challenge}', 'rb') as f:
+        notebook_data = f.read()
+    part = MIMEPart()
+    part.set_content(notebook_data, maintype='text', subtype='ipynb', filename=challenge)
+    if attachments is not None:
+        attachments[(path, challenge)] = part
+    return part
 
 
-def send_email(challenge,
+def make_email(challenge,
                path,
                recipient,
                msg_to,
                msg_from='robert@agilescientific.com',
-               dry_run=True):
-    """Send jupyter notebook to student.
+               attachments=None):
+    """Build the email carrying a jupyter notebook to a student.
     Args
     ----
         challenge: str, challenge filename
@@ -52,10 +56,10 @@ def send_email(challenge,
         recipient: str, name of the recipient
         msg_to: str, email of the recipient
         msg_from: str, email to show as sender
-        dry_run: bool, no emails sent if True
+        attachments: dict, encoded notebook cache, see `get_attachment`
     Returns
     -------
-        None
+        msg: email.message.EmailMessage, ready to send
     """
     # create message object and initialize variables
     msg            = EmailMessage()
@@ -71,12 +75,35 @@ def send_email(challenge,
         msg['Subject'] = f'Agile Katas solution for {challenge_name}'
         msg.set_content(MESSAGE_solution.format(recipient, challenge_name))
 
-    # read the jupyter notebook
-    with open(f'{path}{challenge}', 'rb') as f:
-        notebook_data = f.read()
+    # add attachment, shared between messages so it is only encoded once
+    msg.make_mixed()
+    msg.attach(get_attachment(challenge, path, attachments))
+
+    return msg
 
-    # add attachment
-    msg.add_attachment(notebook_data, maintype='text', subtype='ipynb', filename=challenge)
+
+def send_email(challenge,
+               path,
+               recipient,
+               msg_to,
+               msg_from='robert@agilescientific.com',
+               dry_run=True,
+               attachments=None):
+    """Send jupyter notebook to student.
+    Args
+    ----
+        challenge: str, challenge filename
+        path: str, path to notebooks, example: './weekly-challenge/notebooks/'
+        recipient: str, name of the recipient
+        msg_to: str, email of the recipient
+        msg_from: str, email to show as sender
+        dry_run: bool, no emails sent if True
+        attachments: dict, encoded notebook cache, see `get_attachment`
+    Returns
+    -------
+        None
+    """
+    msg = make_email(challenge, path, recipient, msg_to, msg_from, attachments)
 
     # send email
     if dry_run:
@@ -96,11 +123,181 @@ def send_email(challenge,
     return None
 
 
+class SMTPDispatcher:
+    """Send many emails over a small pool of logged-in SMTP sessions.
+
+    Each session does the TLS handshake and login once and is then reused,
+    sessions send in parallel, all of them together stay under `rate`
+    messages per second, and transient failures (dropped connection,
+    4xx replies) are retried on a fresh session with exponential backoff.
+    Pass `smtp_class=smtplib.SMTP` and a local host/port to run against a
+    stand-in server, e.g. `python -m aiosmtpd -n -l localhost:8025`.
+
+    Args
+    ----
+        host: str, SMTP server
+        port: int, SMTP port
+        login: str, account to log in with, no login if None
+        pwd: str, password of the account
+        sessions: int, number of concurrent SMTP sessions
+        rate: float, max messages per second over all sessions, no limit if None
+        retries: int, attempts per message after the first one
+        backoff: float, seconds before the first retry, doubled on each retry
+        smtp_class: smtplib.SMTP_SSL or smtplib.SMTP (or compatible)
+    """
+    def __init__(self,
+                 host='smtp.gmail.com',
+                 port=465,
+                 login=GMAIL_LOGIN,
+                 pwd=GMAIL_PWD,
+                 sessions=4,
+                 rate=5.,
+                 retries=3,
+                 backoff=1.,
+                 smtp_class=smtplib.SMTP_SSL):
+        self.host = host
+        self.port = port
+        self.login = login
+        self.pwd = pwd
+        self.sessions = sessions
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.smtp_class = smtp_class
+        self.idle = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+        self.stats = {'sent': 0, 'failed': 0, 'retries': 0, 'connections': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        smtp = self.smtp_class(self.host, self.port)
+        if self.login:
+            try:
+                smtp.login(self.login, self.pwd)
+            except Exception:
+                smtp.close()
+                raise
+        with self.lock:
+            self.opened.append(smtp)
+            self.stats['connections'] += 1
+        return smtp
+
+    def _discard(self, smtp):
+        with self.lock:
+            if smtp in self.opened:
+                self.opened.remove(smtp)
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+    def _throttle(self):
+        """Wait for the next send slot shared by all sessions"""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + 1 / self.rate
+        time.sleep(max(slot - now, 0))
+
+    def send(self, msg):
+        """Send one message, retrying transient failures.
+        Args
+        ----
+            msg: email.message.EmailMessage
+        Returns
+        -------
+            None, raises the last error once retries are exhausted
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                smtp = self.idle.get_nowait()
+            except queue.Empty:
+                smtp = None
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                self._throttle()
+                # ************** WARNING *************
+                # the next line sends the actual email
+                smtp.send_message(msg)
+            except smtplib.SMTPRecipientsRefused as e:
+                # one reply per recipient, only worth retrying if none was permanent
+                if smtp is not None:
+                    self.idle.put(smtp)
+                if any(not 400 <= code < 500 for code, _ in e.recipients.values()):
+                    raise
+                error = e
+            except smtplib.SMTPResponseException as e:
+                # 4xx replies are temporary, 5xx (refused sender or data, failed logins) are not worth retrying
+                if not 400 <= e.smtp_code < 500:
+                    if smtp is not None:
+                        self.idle.put(smtp)
+                    raise
+                # the server often hangs up after a 4xx (e.g. 421), retry on a new session
+                if smtp is not None:
+                    self._discard(smtp)
+                error = e
+            except OSError as e:
+                # the session is gone, drop it and retry on a new one
+                if smtp is not None:
+                    self._discard(smtp)
+                error = e
+            else:
+                self.idle.put(smtp)
+                with self.lock:
+                    self.stats['sent'] += 1
+                return None
+            if attempt < self.retries:
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def send_all(self, messages):
+        """Send messages in parallel over the session pool.
+        Args
+        ----
+            messages: iterable of email.message.EmailMessage
+        Returns
+        -------
+            generator of (msg, error) in completion order, error is None if sent
+        """
+        with ThreadPoolExecutor(max_workers=self.sessions) as pool:
+            futures = {pool.submit(self.send, msg): msg for msg in messages}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    with self.lock:
+                        self.stats['failed'] += 1
+                yield futures[future], error
+
+    def close(self):
+        """Log out of every open session"""
+        with self.lock:
+            opened, self.opened = self.opened, []
+        for smtp in opened:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+        self.idle = queue.LifoQueue()
+
+
 def send_summary_email(notebooks_sent,
                        n,
                        msg_to='robert@agilescientific.com',
                        msg_from='robert@agilescientific.com',
-                       dry_run=True):
+                       dry_run=True,
+                       dispatcher=None):
     """Send a summary email including which files were sent to who.
     Args
     ----
@@ -109,6 +306,7 @@ def send_summary_email(notebooks_sent,
         msg_to: str, email of the recipient
         msg_from: str, email to show as sender
         dry_run: bool, no email sent if True
+        dispatcher: SMTPDispatcher to send with, a new connection if None
     Returns
     -------
         None
@@ -125,6 +323,9 @@ def send_summary_email(notebooks_sent,
 
     if dry_run:
         print(f'\nDry run: Would have sent summary email to {msg_to} with msg:\n{"-"*40}\n{msg}\n{"-"*40}')
+    elif dispatcher is not None:
+        print(f'Sending summary email to {msg_to}')
+        dispatcher.send(msg)
     else:
         with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
             smtp.login(GMAIL_LOGIN, GMAIL_PWD)
@@ -137,12 +338,15 @@ def send_summary_email(notebooks_sent,
     return None
 
 
-def iterate_and_send(fname, dry_run=True):
+def iterate_and_send(fname, dry_run=True, sessions=None, dispatcher=None):
     """Load the tracking CSV file and send emails as required.
     Args
     ----
         fname: str, filename including target students and notebooks
         dry_run: if True not email sent
+        sessions: int, send over this many reused SMTP sessions in parallel,
+                  one connection per email if None
+        dispatcher: SMTPDispatcher to send with, overrides sessions
     Returns
     -------
         df: pandas DataFrame showing students and dates when notebooks sent
@@ -154,26 +358,55 @@ def iterate_and_send(fname, dry_run=True):
     n              = 0
     challenges     = []
     notebooks_sent = {}
-    for col in df.columns[[True if '.ipynb' in col else False for col in df.columns]]:
+    attachments    = {}
+    for col in notebook_columns(df):
         notebooks_sent[col] = []
 
-    # iterate
-    for row, d in enumerate(df.apply(get_notebook_to_send, axis=1, args=(df, PATH))):
-        # skip if solution already sent
-        if d is None:
+    # sends journaled by an interrupted run are not sent again
+    replayed = replay_journal(df, fname)
+    if replayed:
+        print(f'Recovered {replayed} sends from an interrupted run.')
+
+    # only a dispatcher made here is closed here, the caller's can be reused
+    owned = bool(dispatcher is None and sessions and not dry_run)
+    if owned:
+        dispatcher = SMTPDispatcher(sessions=sessions)
+    pending = {}
+
+    # iterate over the students with a notebook left to send
+    for row, d in get_notebooks_to_send(df, PATH).items():
+        if d['challenge'] not in challenges:
+            challenges.append(d['challenge'])
+        if dispatcher is not None and not dry_run:
+            # queued, sent in parallel below
+            msg = make_email(d['challenge'], PATH, d['name'], d['email'], attachments=attachments)
+            pending[id(msg)] = (msg, row, d)
             continue
-        else:
-            if d['challenge'] not in challenges:
-                challenges.append(d['challenge'])
-            col = d['challenge']
-            # send email and log progress
-            send_email(d['challenge'], PATH, d['name'], d['email'], dry_run=dry_run)
+        col = d['challenge']
+        # send email and log progress
+        send_email(d['challenge'], PATH, d['name'], d['email'], dry_run=dry_run, attachments=attachments)
+        notebooks_sent[d['challenge']].append(d['email'])
+        n += 1
+        df.loc[row, col] = date.today().isoformat()
+        # journal the send, the sheet is written once at the end
+        if not dry_run:
+            journal_sent(fname, d['email'], col, date.today().isoformat())
+
+    if pending:
+        for msg, error in dispatcher.send_all(m for m, _, _ in pending.values()):
+            _, row, d = pending[id(msg)]
+            if error is not None:
+                print(f'!!! Failed to send {d["challenge"]} to {d["email"]}: {error} !!!')
+                continue
+            print(f'*** On {date.today()}, {d["challenge"]} was sent to {d["email"]} ***')
             notebooks_sent[d['challenge']].append(d['email'])
             n += 1
-            df.loc[row, col] = date.today().isoformat()
-            # write to local file
-            if not dry_run:
-                df.to_csv(fname, index=False)
+            df.loc[row, d['challenge']] = date.today().isoformat()
+            journal_sent(fname, d['email'], d['challenge'], date.today().isoformat())
+
+    # write to local file
+    if not dry_run and (n or replayed):
+        compact_journal(df, fname)
 
     print(f'Logging...:\nEmailing complete, {n} emails sent.')
     print(f'{n} updates to \'{fname}\' done on {date.today()}\n')
@@ -181,13 +414,17 @@ def iterate_and_send(fname, dry_run=True):
     # email summary
     if n > 0:
         notebooks_sent = {k: v for k, v in notebooks_sent.items() if v}
-        send_summary_email(notebooks_sent, n, dry_run=dry_run)
+        send_summary_email(notebooks_sent, n, dry_run=dry_run, dispatcher=dispatcher)
+    if dispatcher is not None:
+        if owned:
+            dispatcher.close()
+        print(f'SMTP dispatcher: {dispatcher.stats}')
 
     return df
 
 
-def main(fname, dry_run):
-    _ = iterate_and_send(fname, dry_run=dry_run)
+def main(fname, dry_run, sessions=None):
+    _ = iterate_and_send(fname, dry_run=dry_run, sessions=sessions)
 
 if __name__ == '__main__':
     try:
@@ -199,4 +436,9 @@ if __name__ == '__main__':
         dry_run = bool(strtobool(sys.argv[2]))
     except IndexError:
         dry_run = True
-    main(fname, dry_run)
+    try:
+        # number of parallel SMTP sessions, e.g. 4 for large cohorts
+        sessions = int(sys.argv[3])
+    except IndexError:
+        sessions = None
+    main(fname, dry_run, sessions)
@@ -0,0 +1,126 @@
+import numpy as np
+
+# runs are logged to the 10 metres, so a 0.01km histogram loses nothing
+RESOLUTION = 0.01
+
+
+def new_hist(resolution=RESOLUTION):
+    """Make an empty streaming histogram of distances
+    Args:
+        resolution: bin width [km]
+    Returns:
+        h: dict holding fine bin counts and running sums, update with `update_hist`
+    """
+    return {'resolution': resolution,
+            'counts': np.zeros(0, dtype=np.int64),
+            'n': 0,
+            'sum': 0.,
+            'sumsq': 0.,
+            'min': np.inf,
+            'max': -np.inf,
+            }
+
+
+def update_hist(h, values):
+    """Add distances to a streaming histogram, O(len(values)) whatever the history length
+    Args:
+        h: dict from `new_hist`
+        values: array-like of distances [km], must be >= 0
+    Returns:
+        h
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    if values.size == 0:
+        return h
+    idx = np.rint(values / h['resolution']).astype(np.int64)
+    added = np.bincount(idx)
+    if added.size > h['counts'].size:
+        h['counts'] = np.pad(h['counts'], (0, added.size - h['counts'].size))
+    h['counts'][:added.size] += added
+    h['n'] += values.size
+    h['sum'] += values.sum()
+    h['sumsq'] += (values ** 2).sum()
+    h['min'] = min(h['min'], values.min())
+    h['max'] = max(h['max'], values.max())
+    return h
+
+
+def hist_from_values(values, resolution=RESOLUTION):
+    """Build a streaming histogram in one go, e.g. from `df.Distance`"""
+    return update_hist(new_hist(resolution), values)
+
+
+def mean(h):
+    return h['sum'] / h['n']
+
+
+def std(h):
+    """Sample standard deviation"""
+    return np.sqrt((h['sumsq'] - h['sum'] ** 2 / h['n']) / (h['n'] - 1))
+
+
+def quantile(h, q):
+    """Quantile read off the cumulative fine-bin counts
+    Uses the same linear interpolation between order statistics as
+    `pd.Series.quantile`, exact for values on the histogram resolution.
+    Args:
+        h: dict from `new_hist`
+        q: quantile(s) in [0, 1]
+    Returns:
+        value(s) at quantile q
+    """
+    q = np.asarray(q, dtype=float)
+    cum = np.cumsum(h['counts'])
+    # 0-based ranks of the order statistics either side of q
+    rank = q * (h['n'] - 1)
+    lo = np.searchsorted(cum, np.floor(rank), side='right')
+    hi = np.searchsorted(cum, np.ceil(rank), side='right')
+    res = h['resolution']
+    return lo * res + (rank - np.floor(rank)) * (hi - lo) * res
+
+
+def rebin(h, edges):
+    """Counts of the fine histogram in coarser bins with the given edges"""
+    centres = np.arange(h['counts'].size) * h['resolution']
+    return np.histogram(centres, bins=edges, weights=h['counts'])[0]
+
+
+def kde(h, grid_step=0.05, bandwidth=None, cut=3):
+    """Gaussian KDE by binning onto a regular grid and convolving with FFT
+    Cost depends on the grid size only, not on the number of runs.
+    Args:
+        h: dict from `new_hist`
+        grid_step: grid spacing [km]
+        bandwidth: kernel standard deviation [km], Scott's rule if None,
+                   `grid_step` when all distances are the same
+        cut: extend the grid this many bandwidths past the data, like seaborn
+    Returns:
+        x, density: grid and estimated density, integrating to 1
+    """
+    if bandwidth is None:
+        bandwidth = std(h) * h['n'] ** (-1 / 5) if h['n'] > 1 else 0.
+    if not bandwidth > 0:
+        # every run the same distance, Scott's rule gives no width at all
+        bandwidth = grid_step
+    x0 = h['min'] - cut * bandwidth
+    n_grid = int(np.ceil((h['max'] + cut * bandwidth - x0) / grid_step)) + 1
+    x = x0 + np.arange(n_grid) * grid_step
+
+    # linear binning of the fine histogram onto the grid
+    nonzero = np.flatnonzero(h['counts'])
+    pos = (nonzero * h['resolution'] - x0) / grid_step
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    grid = np.zeros(n_grid)
+    np.add.at(grid, left, h['counts'][nonzero] * (1 - frac))
+    np.add.at(grid, np.minimum(left + 1, n_grid - 1), h['counts'][nonzero] * frac)
+
+    # convolve with the gaussian kernel, zero padded so nothing wraps around
+    half = min(int(np.ceil(cut * bandwidth / grid_step)), n_grid)
+    k = np.arange(-half, half + 1) * grid_step
+    kernel = np.exp(-0.5 * (k / bandwidth) ** 2)
+    kernel /= kernel.sum() * grid_step
+    size = n_grid + kernel.size - 1
+    density = np.fft.irfft(np.fft.rfft(grid, size) * np.fft.rfft(kernel, size), size)
+    density = density[half:half + n_grid] / h['n']
+    return x, np.clip(density, 0, None)
@@ -0,0 +1,147 @@
+"""Tracking sheet helpers for `email_katas`.
+
+The tracking sheet has one row per student (`recipient`, `email`) and one
+column per notebook, ending in `.ipynb`, holding the date it was sent or
+NaN while it is still to be sent.
+
+Sends are journaled one line each as they happen, `email,notebook,date`,
+and the sheet itself is rewritten once at the end of a run. A run that
+dies part way replays the journal first, so nobody is emailed twice.
+
+Kept apart from `email_katas` so it can be used and benchmarked without
+the email credentials in `enviro`.
+"""
+import io
+import os
+import csv
+
+import numpy as np
+
+
+NOTEBOOK_SUFFIX = '.ipynb'
+
+
+def notebook_columns(df):
+    """Names of the notebook columns of a tracking sheet, in order"""
+    return [col for col in df.columns if NOTEBOOK_SUFFIX in col]
+
+
+def get_notebook_to_send(row, df, PATH):
+    """Find the first empty column and return dict of some row values.
+    Args
+    ----
+        row: pandas.core.series.Series
+        df:  pandas.core.frame.DataFrame
+        PATH: str, path to notebooks
+    Returns
+    -------
+        d: dict, dictionary of data for given row at first empty column
+    """
+    for idx, col in enumerate(row):
+        try:
+            # find columns (challenges) that have not been sent yet
+            if np.isnan(col):
+                d = {'name': row.recipient,
+                     'email': row.email,
+                     'challenge': df.columns[idx],
+                     'challenge_path': PATH + df.columns[idx],
+                    }
+                return d
+        except TypeError:
+            continue
+
+
+def get_notebooks_to_send(df, PATH):
+    """Find the first empty notebook column of every student at once.
+    Vectorized equivalent of `df.apply(get_notebook_to_send, axis=1)`:
+    one NaN mask over the notebook columns and an argmax per row.
+    Args
+    ----
+        df:  pandas.core.frame.DataFrame, the tracking sheet
+        PATH: str, path to notebooks
+    Returns
+    -------
+        to_send: dict, row index label to the dict `get_notebook_to_send`
+                 gives, only for students with a notebook left to send
+    """
+    columns = notebook_columns(df)
+    if not columns or df.empty:
+        return {}
+    missing = df[columns].isna().to_numpy()
+    # argmax finds the first True, rows without any are dropped
+    first = missing.argmax(axis=1)
+    rows = np.flatnonzero(missing[np.arange(len(df)), first])
+    challenges = np.asarray(columns, dtype=object)[first[rows]]
+    return {label: {'name': name,
+                    'email': email,
+                    'challenge': challenge,
+                    'challenge_path': PATH + challenge,
+                    }
+            for label, name, email, challenge in zip(df.index[rows],
+                                                     df['recipient'].to_numpy()[rows],
+                                                     df['email'].to_numpy()[rows],
+                                                     challenges)}
+
+
+def journal_path(fname):
+    """Journal of the sends not yet written to the tracking sheet `fname`"""
+    return fname + '.journal'
+
+
+def journal_sent(fname, email, challenge, day):
+    """Record one sent notebook, durable before the next email goes out.
+    Args
+    ----
+        fname: str, tracking sheet filename
+        email: str, email of the student
+        challenge: str, notebook column
+        day: str, ISO date the notebook was sent
+    Returns
+    -------
+        None
+    """
+    line = io.StringIO()
+    csv.writer(line).writerow([email, challenge, day])
+    with open(journal_path(fname), 'a', newline='') as f:
+        f.write(line.getvalue())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def replay_journal(df, fname):
+    """Apply the journal left by an interrupted run to the tracking sheet.
+    Args
+    ----
+        df: pandas.core.frame.DataFrame, the tracking sheet as read from `fname`
+        fname: str, tracking sheet filename
+    Returns
+    -------
+        n: int, number of journaled sends applied to `df`
+    """
+    try:
+        f = open(journal_path(fname), newline='')
+    except FileNotFoundError:
+        return 0
+    with f:
+        # a crash mid-write leaves at most one partial last line
+        records = [r for r in csv.reader(f) if len(r) == 3]
+    rows = {email: label for label, email in zip(df.index, df['email'])}
+    n = 0
+    for email, challenge, day in records:
+        if email in rows and challenge in df.columns:
+            df.loc[rows[email], challenge] = day
+            n += 1
+    return n
+
+
+def compact_journal(df, fname):
+    """Write the tracking sheet once, atomically, and drop the journal"""
+    tmp = fname + '.tmp'
+    df.to_csv(tmp, index=False)
+    with open(tmp) as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, fname)
+    try:
+        os.remove(journal_path(fname))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,108 @@
+import os
+import sys
+import glob
+
+import numpy as np
+import pandas as pd
+
+from runlog import load_runlog
+
+
+def is_runlog(path):
+    """True for a runlog CSV (`.csv` or no extension) or a `runstore` directory,
+    False for the sidecars `addrun`, `runstats` and `runstore` write next to them"""
+    if os.path.isdir(path):
+        return os.path.exists(os.path.join(path, 'ts.i8'))
+    return os.path.splitext(path)[1] in ('', '.csv')
+
+
+def find_runlogs(pattern):
+    """List runlogs from a directory or a glob pattern
+    Args:
+        pattern: directory holding one runlog per athlete, or a glob like `'logs/*.csv'`
+    Returns:
+        dict of athlete name (file name without extension) to runlog path,
+        raises ValueError when two runlogs give the same name, e.g. `alice.csv`
+        and a store directory `alice`
+    """
+    if os.path.isdir(pattern) and not os.path.exists(os.path.join(pattern, 'ts.i8')):
+        pattern = os.path.join(pattern, '*')
+    paths = sorted(p for p in glob.glob(pattern) if is_runlog(p.rstrip(os.sep)))
+    runlogs = {}
+    for p in paths:
+        athlete = os.path.splitext(os.path.basename(p.rstrip(os.sep)))[0]
+        if athlete in runlogs:
+            raise ValueError(f'{runlogs[athlete]} and {p} are both runlogs of {athlete!r}, keep only one')
+        runlogs[athlete] = p
+    return runlogs
+
+
+def load_club(runlogs):
+    """Stack every athlete's runlog into one long df
+    Args:
+        runlogs: dict of athlete name to runlog path, from `find_runlogs`
+    Returns:
+        df with `athlete, DateTime, Distance` columns sorted by athlete then DateTime
+    """
+    frames = [load_runlog(path).reset_index().assign(athlete=athlete)
+              for athlete, path in runlogs.items()]
+    df = pd.concat(frames, ignore_index=True)
+    df['athlete'] = df['athlete'].astype('category')
+    return df.sort_values(['athlete', 'DateTime'], kind='stable', ignore_index=True)
+
+
+def club_stats(df):
+    """`calculate_stats`, `days_since_last_run` and `check_progress_rate` for every athlete in one grouped pass
+    Args:
+        df: long df from `load_club`
+    Returns:
+        summary df indexed by athlete
+    """
+    dt = df['DateTime']
+    day = dt.dt.normalize()
+    df = df.assign(total_time=(dt - day).dt.total_seconds() / 60)
+    df['avg_speed'] = df['Distance'] / df['total_time'] * 60
+    df['gap_days'] = (dt - df.groupby('athlete', observed=True)['DateTime'].shift()).dt.days
+    g = df.groupby('athlete', observed=True, sort=True)
+
+    summary = g.agg(run_count=('Distance', 'size'),
+                    first_run=('DateTime', 'first'),
+                    last_run=('DateTime', 'last'),
+                    mean_dist=('Distance', 'mean'),
+                    mean_speed=('avg_speed', 'mean'),
+                    pb_distance=('Distance', 'max'),
+                    pb_speed=('avg_speed', 'max'),
+                    total_distance=('Distance', 'sum'),
+                    last_distance=('Distance', 'last'),
+                    last_speed=('avg_speed', 'last'),
+                    days_since_last_run=('gap_days', 'last'),
+                    )
+    weeks = (summary['last_run'].dt.normalize() - summary['first_run'].dt.normalize()).dt.days // 7
+    summary['run_freq'] = summary['run_count'] / weeks.replace(0, np.nan)
+    summary['new_pb_distance'] = summary['pb_distance'] == summary['last_distance']
+    summary['new_pb_speed'] = summary['pb_speed'] == summary['last_speed']
+
+    # previous week window, from 8 days to 1 day before each athlete's last run
+    last = g['DateTime'].transform('last')
+    in_week = (dt >= last - pd.Timedelta(days=8)) & (dt <= last - pd.Timedelta(days=1))
+    week = df[in_week].groupby('athlete', observed=False, sort=True)['Distance']
+    summary['prev_week_runs'] = week.size().reindex(summary.index, fill_value=0)
+    summary['prev_week_avg'] = week.mean().reindex(summary.index)
+    summary['prev_week_max'] = week.max().reindex(summary.index)
+    summary['over_week_avg_pct'] = (summary['last_distance'] - summary['prev_week_avg']) * 100 / summary['prev_week_avg']
+    summary['over_week_max_pct'] = (summary['last_distance'] - summary['prev_week_max']) * 100 / summary['prev_week_max']
+    # `check_progress_rate` only runs when the last gap is a week or less
+    recent = summary['days_since_last_run'] <= 7
+    summary['progress_warning'] = recent & ((summary['over_week_avg_pct'] > 10) | (summary['over_week_max_pct'] > 10))
+
+    return summary.drop(columns=['first_run'])
+
+
+if __name__ == '__main__':
+    summary = club_stats(load_club(find_runlogs(sys.argv[1])))
+    try:
+        summary.to_csv(sys.argv[2])
+        print(f'Summary of {summary.shape[0]} athletes written to {sys.argv[2]}')
+    except IndexError:
+        with pd.option_context('display.max_columns', None, 'display.width', 200, 'display.precision', 2):
+            print(summary)
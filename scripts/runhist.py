@@ -1,13 +1,14 @@
 import sys
 import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 from scipy import stats
 
-from runlog import make_df_from_csv
+import histkde
+from runlog import load_runlog
+import timeindex
 
-def make_hist(df, start_plot, end_plot):
-    """Make a histogram of runs"""
+def make_hist(df, start_plot, end_plot, fname=None):
+    """Make a histogram of runs, saved to `fname` (png, svg, ...) instead of shown when given"""
     try:
         _start_plot = start_plot.date()
     except AttributeError:
@@ -17,38 +18,49 @@ def make_hist(df, start_plot, end_plot):
     except AttributeError:
         _end_plot = end_plot
 
-    dist_min, dist_max = np.floor(df.Distance.min()), np.ceil(df.Distance.max())
+    h = histkde.hist_from_values(df.Distance.to_numpy())
+    dist_min, dist_max = np.floor(h['min']), np.ceil(h['max'])
 
-    _, ax = plt.subplots(figsize=(20, 10))
+    fig, ax = plt.subplots(figsize=(20, 10))
     bins = np.arange(dist_min-1, dist_max+1, 1)
-    sns.histplot(data=df,
-                ax=ax,
-                kde=True,
-                stat='probability'
-                )
+    # probability histogram with its KDE, both from the fine histogram
+    prob = histkde.rebin(h, bins) / h['n']
+    ax.bar(bins[:-1], prob, width=1, align='edge', alpha=0.5, edgecolor='k', label='Distance')
+    if h['n'] > 1:
+        # bins are 1km wide so the density is also the probability per bin
+        x, density = histkde.kde(h)
+        ax.plot(x, density, c='C0', lw=1.5)
     plt.title(f"Rob's run distribution from {_start_plot} to {_end_plot}", fontsize=14)
     plt.xlabel('Distance [km]')
-    sns.rugplot(data=df,
-                ax=ax,
-                )
-    mean, median, perc25, perc75 = df.Distance.mean(), df.Distance.median(), df.Distance.describe().loc['25%'], df.Distance.describe().loc['75%']
+    plt.ylabel('Probability')
+    # rug of distinct distances, bounded by the histogram resolution
+    rug = np.flatnonzero(h['counts']) * h['resolution']
+    ax.vlines(rug, 0, 0.025, transform=ax.get_xaxis_transform(), color='C0', lw=1)
+    mean = histkde.mean(h)
+    perc25, median, perc75 = histkde.quantile(h, [0.25, 0.5, 0.75])
     ax.axvline(perc25, color='r', linestyle='-', lw=1.5, label='25 percentile')
     ax.axvline(median, color='g', linestyle='--', lw=1.5, label='median')
     ax.axvline(mean, color='b', linestyle='-.', lw=1.5, label='mean')
     ax.axvline(perc75, color='k', linestyle=':', lw=1.5, label='75 percentile')
-    ax.text(mean, 45, f' {mean:.1f}km')
-    ax.text(median, 45, f' {median:.1f}km')
-    ax.text(perc25, 45, f' {perc25:.1f}km')
-    ax.text(perc75, 45, f' {perc75:.1f}km')
+    # label the lines near the top of the axes whatever the y scale
+    text_y = ax.get_xaxis_transform()
+    ax.text(mean, 0.95, f' {mean:.1f}km', transform=text_y)
+    ax.text(median, 0.95, f' {median:.1f}km', transform=text_y)
+    ax.text(perc25, 0.95, f' {perc25:.1f}km', transform=text_y)
+    ax.text(perc75, 0.95, f' {perc75:.1f}km', transform=text_y)
     plt.xticks(ticks=bins)
     plt.grid(c='k', alpha=0.2)
     ax.legend()
-    plt.show()
+    if fname is None:
+        plt.show()
+    else:
+        fig.savefig(fname)
+        plt.close(fig)
     return None
 
 
 if __name__ == "__main__":
-    df = make_df_from_csv(sys.argv[1])
+    df = load_runlog(sys.argv[1])
     start_plot, end_plot = df.index[0], df.index[-1]
     try:
         if sys.argv[2]:
@@ -60,5 +72,5 @@ if __name__ == "__main__":
             end_plot = sys.argv[3]
     except IndexError:
         pass
-    df = df[start_plot:end_plot]
+    df = df.iloc[timeindex.window(timeindex.build_time_index(df.index), start_plot, end_plot)]
     make_hist(df, start_plot, end_plot)
\ No newline at end of file
@@ -3,9 +3,17 @@ import numpy as np
 import pandas as pd
 from pandas.plotting import register_matplotlib_converters
 register_matplotlib_converters()
+import os
 import sys
 import math
-from datetime import date, timedelta
+
+import runstats
+import runstore
+import timeindex
+import decimate
+
+# about the pixel width of the plot area
+LOD_POINTS = 1500
 
 def make_df_from_csv(fname):
     """Make df"""
@@ -15,37 +23,52 @@ def make_df_from_csv(fname):
 
     return df
 
-def calculate_stats(df):
+
+def make_df_from_store(path):
+    """Make df from a `runstore` directory, the memory-mapped columns are read and copied once on load
+    Distances are stored as float32, they are rounded to the 2 decimals of the log so
+    that e.g. 24.96 doesn't come back as 24.959999084472656.
+    """
+    cols = runstore.open_store(path)
+    df = pd.DataFrame({'Distance': np.round(cols['dist'].astype('f8'), 2)},
+                      index=pd.DatetimeIndex(runstore.run_index(cols), name='DateTime'))
+    return df
+
+
+def load_runlog(fname):
+    """Make df from either a runlog CSV or a `runstore` directory"""
+    if os.path.isdir(fname):
+        return make_df_from_store(fname)
+    return make_df_from_csv(fname)
+
+
+def calculate_stats(df, state=None):
+    """Add derived columns to df and return the stats panel
+    Args:
+        df: runlog DataFrame from `make_df_from_csv`
+        state: optional running state from `runstats.load_state`, when given the
+               stats panel and PB checks are read from it rather than recomputed
+    Returns:
+        textstr, avg_speed, avg_distance
+    """
     df['total_time'] = df.index.hour * 60 + df.index.minute + df.index.second / 60
     df['avg_speed'] = df.Distance / df.total_time * 60
+    df['Speed_rolling_mean'] = df['avg_speed'].rolling(10).mean()
+    df['Distance_rolling_mean'] = df['Distance'].rolling(10).mean()
+    df['Runtime_rolling_mean'] = df['total_time'].rolling(10).mean()
+    if state is not None:
+        return runstats.calculate_stats(state)
+
     pb_dist = df['Distance'].max()
     pb_speed = df['avg_speed'].max()
-    last_dist = df['Distance'][-1]
-    last_speed = df['avg_speed'][-1]
+    last_dist = df['Distance'].iloc[-1]
+    last_speed = df['avg_speed'].iloc[-1]
     weeks = (df.index.date[-1] - df.index.date[0]).days // 7
     avg_speed = df['avg_speed'].mean()
-    df['Speed_rolling_mean'] = df['avg_speed'].rolling(10).mean()
     avg_distance = df['Distance'].mean()
-    df['Distance_rolling_mean'] = df['Distance'].rolling(10).mean()
-    df['Runtime_rolling_mean'] = df['total_time'].rolling(10).mean()
-    title1 = r"$\bf{Period\ stats:}$"
-    title2 = r"$\bf{Last\ run:}$"
-    textstr = f'''
-    {title1}
-    ---------------------
-    run_count: {df.shape[0]}
-    run_freq: {df.shape[0] / weeks:.1f} runs/week
-    mean_dist: {df.describe().loc['mean', 'Distance']:.2f} km
-    mean_speed: {df.describe().loc['mean', 'avg_speed']:.2f} km/hr
-    PB distance: {df.describe().loc['max', 'Distance']} km
-    PB speed: {df.describe().loc['max', 'avg_speed']:.2f} km/hr
-    Total distance: {df['Distance'].sum():.2f} km
-
-    {title2}
-    ---------------
-    distance: {last_dist}km
-    speed: {last_speed:.2f}km/hr
-    '''
+    textstr = runstats.make_textstr(df.shape[0], weeks, avg_distance, avg_speed,
+                                    pb_dist, pb_speed, df['Distance'].sum(),
+                                    last_dist, last_speed)
 
     if pb_dist == last_dist:
         print(f'New PB distance! {pb_dist:.2f}km')
@@ -55,22 +78,23 @@ def calculate_stats(df):
     return textstr, avg_speed, avg_distance
 
 
-def days_since_last_run(df):
+def days_since_last_run(df, tidx=None):
     """check if more than a week since last run"""
-    last_run_date = df.index[-1]
-    penultimate_run_date = df.index[-2]
-    return (last_run_date - penultimate_run_date).days
+    if tidx is None:
+        tidx = timeindex.build_time_index(df.index)
+    return timeindex.days_since_last_run(tidx)
 
 
-def check_progress_rate(df):
+def check_progress_rate(df, tidx=None):
     """Warn if distance delta between last run and previous week max is > 10%"""
-    last_run_dist = df['Distance'][-1]
-    last_run_date = df.index[-1]
-    tdelta_day = timedelta(days=1)
-    tdelta_week = timedelta(days=1, weeks=1)
-    nruns = df[last_run_date - tdelta_week:last_run_date - tdelta_day]['Distance'].shape[0]
-    last_week_max = df[last_run_date - tdelta_week:last_run_date - tdelta_day]['Distance'].max()
-    last_week_avg_dist = df[last_run_date - tdelta_week:last_run_date - tdelta_day]['Distance'].sum() / nruns
+    if tidx is None:
+        tidx = timeindex.build_time_index(df.index)
+    distance = df['Distance'].to_numpy()
+    last_run_dist = distance[-1]
+    last_week = distance[timeindex.previous_week(tidx)]
+    nruns = last_week.shape[0]
+    last_week_max = last_week.max() if nruns else np.nan
+    last_week_avg_dist = last_week.sum() / nruns if nruns else np.nan
     if last_run_dist > last_week_avg_dist + last_week_avg_dist * 0.1:
         print(f'The last run exceeded the previous week average by {(last_run_dist - last_week_avg_dist) * 100 / last_week_avg_dist:.0f}%.')
     if last_run_dist > last_week_max + last_week_max * 0.1:
@@ -85,9 +109,23 @@ def make_patch_spines_invisible(ax):
         sp.set_visible(False)
 
 
-def make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot):
-    """Make run plot"""
+def make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot, fname=None,
+              max_points=LOD_POINTS, method='lttb'):
+    """Make run plot, saved to `fname` (png, svg, ...) instead of shown when given
+    Runlogs longer than `max_points` are drawn at a level of detail: the lines are
+    decimated with `decimate.lttb` (or `'minmax'`) and run times are shown as weekly
+    or monthly mean bars. Use `max_points=None` to always plot every run.
+    """
     small_df = 75
+    lod = max_points is not None and df.shape[0] > max_points
+    if lod:
+        series = {col: decimate.decimate_series(df[col], max_points, method)
+                  for col in ('avg_speed', 'Distance', 'Speed_rolling_mean',
+                              'Distance_rolling_mean', 'Runtime_rolling_mean')}
+        bar_x, bar_height, bar_width = decimate.bin_runtime(df['total_time'])
+    else:
+        series = df
+        bar_x, bar_height, bar_width = df.index, df.total_time, 1.5
     fig, host = plt.subplots(figsize=(20,10), nrows=1, ncols=1)
     # create a second plot that is offset and only shows one spine
     fig.subplots_adjust(right=0.75)
@@ -106,18 +144,18 @@ def make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot):
         style_d1 = plot_marker['d1_small']
         style_d2 = plot_marker['d2_small']
 
-    d1, = host.plot(df.avg_speed, style_d1, label="Avg speed [km/h]", c='r', markersize=4, lw=1)
-    d2, = par1.plot(df.Distance, style_d2, label="Distance [km]", c='g', markersize=4, lw=1)
-    d3 = par2.bar(df.index, height=df.total_time, label='Run time [min]', width=1.5, alpha=0.2, color='b')
+    d1, = host.plot(series['avg_speed'], style_d1, label="Avg speed [km/h]", c='r', markersize=4, lw=1)
+    d2, = par1.plot(series['Distance'], style_d2, label="Distance [km]", c='g', markersize=4, lw=1)
+    d3 = par2.bar(bar_x, height=bar_height, label='Run time [min]', width=bar_width, alpha=0.2, color='b')
 
     # add averages
     d4 = host.axhline(y=avg_speed, xmin=0, xmax=1, ls='-', lw=2, alpha=0.3, c='r', label='Avg speed abs')
     d5 = par1.axhline(y=avg_distance, xmin=0, xmax=1, ls='-', lw=2, alpha=0.3, c='g', label='Avg dist abs')
 
     # add rolling means
-    d6, = host.plot(df.Speed_rolling_mean, ls='-', lw=4, c='r', alpha=0.3, label='Speed roll_mean_10')
-    d7, = par1.plot(df.Distance_rolling_mean, ls='-', lw=4, c='g', alpha=0.3, label='Dist roll_mean_10')
-    d8, = par2.plot(df.Runtime_rolling_mean, ls='-', lw=4, c='b', alpha=0.3, label='Time roll_mean_10')
+    d6, = host.plot(series['Speed_rolling_mean'], ls='-', lw=4, c='r', alpha=0.3, label='Speed roll_mean_10')
+    d7, = par1.plot(series['Distance_rolling_mean'], ls='-', lw=4, c='g', alpha=0.3, label='Dist roll_mean_10')
+    d8, = par2.plot(series['Runtime_rolling_mean'], ls='-', lw=4, c='b', alpha=0.3, label='Time roll_mean_10')
 
     # add time lines
     time_line_formats = {'xmin':0, 'xmax': 1, 'ls':'dashed', 'lw':1, 'alpha':0.3, 'c': 'b'}
@@ -125,8 +163,8 @@ def make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot):
         par2.axhline(y=quarter_hour, **time_line_formats, label=f'{quarter_hour}min')
 
     # add PB's
-    pb_speed = (df.loc[df['avg_speed'] == df['avg_speed'].max()].index[0], df.loc[df['avg_speed'] == df['avg_speed'].max()]['avg_speed'][0])
-    pb_distance = (df.loc[df['Distance'] == df['Distance'].max()].index[0], df.loc[df['Distance'] == df['Distance'].max()]['Distance'][0])
+    pb_speed = (df['avg_speed'].idxmax(), df['avg_speed'].max())
+    pb_distance = (df['Distance'].idxmax(), df['Distance'].max())
     host.plot(pb_speed[0], pb_speed[1], marker='*', c='r', markersize=15)
     par1.plot(pb_distance[0], pb_distance[1], marker='*', c='g', markersize=15)
 
@@ -187,11 +225,15 @@ def make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot):
         verticalalignment='top', bbox=props)
 
     fig.tight_layout(pad=5)
-    plt.show()
+    if fname is None:
+        plt.show()
+    else:
+        fig.savefig(fname)
+        plt.close(fig)
     return
 
 if __name__ == "__main__":
-    df = make_df_from_csv(sys.argv[1])
+    df = load_runlog(sys.argv[1])
     start_plot, end_plot = df.index[0], df.index[-1]
     try:
         if sys.argv[2]:
@@ -203,8 +245,11 @@ if __name__ == "__main__":
             end_plot = sys.argv[3]
     except IndexError:
         pass
-    df = df[start_plot:end_plot]
-    textstr, avg_speed, avg_distance = calculate_stats(df)
-    if days_since_last_run(df) <= 7:
-        check_progress_rate(df)
+    # the running stats cover the whole log, only use them without a date range
+    state = runstats.load_state(sys.argv[1]) if len(sys.argv) < 3 and not os.path.isdir(sys.argv[1]) else None
+    df = df.iloc[timeindex.window(timeindex.build_time_index(df.index), start_plot, end_plot)]
+    tidx = timeindex.build_time_index(df.index)
+    textstr, avg_speed, avg_distance = calculate_stats(df, state)
+    if days_since_last_run(df, tidx) <= 7:
+        check_progress_rate(df, tidx)
     make_plot(df, textstr, avg_speed, avg_distance, start_plot, end_plot)
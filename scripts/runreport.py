@@ -0,0 +1,291 @@
+import os
+import sys
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.collections import PolyCollection, LineCollection
+import numpy as np
+
+import decimate
+import histkde
+import timeindex
+from runbatch import find_runlogs
+from runlog import LOD_POINTS, load_runlog, calculate_stats, make_patch_spines_invisible
+
+SMALL_DF = 75
+BAR_WIDTH = 1.5  # days
+MIN_SPEED, MIN_DIST, MIN_TIME = 1, 1, 15
+
+# one figure per kind per worker process, only its data is updated between renders
+_TEMPLATES = {}
+
+
+def make_template():
+    """Build the `runlog.make_plot` figure once with empty artists
+    Returns:
+        template: dict of the figure, axes and artists to update
+    """
+    fig, host = plt.subplots(figsize=(20,10), nrows=1, ncols=1)
+    fig.subplots_adjust(right=0.75)
+    par1 = host.twinx()
+    par2 = host.twinx()
+    par2.spines["right"].set_position(("axes", 1.04))
+    make_patch_spines_invisible(par2)
+    par2.spines["right"].set_visible(True)
+    host.xaxis_date()
+
+    t = {'fig': fig, 'host': host, 'par1': par1, 'par2': par2}
+    t['d1'], = host.plot([], [], 'o-', label="Avg speed [km/h]", c='r', markersize=4, lw=1)
+    t['d2'], = par1.plot([], [], 'o-', label="Distance [km]", c='g', markersize=4, lw=1)
+    t['d3'] = PolyCollection([], label='Run time [min]', alpha=0.2, facecolor='b')
+    par2.add_collection(t['d3'])
+    t['d4'] = host.axhline(y=0, xmin=0, xmax=1, ls='-', lw=2, alpha=0.3, c='r', label='Avg speed abs')
+    t['d5'] = par1.axhline(y=0, xmin=0, xmax=1, ls='-', lw=2, alpha=0.3, c='g', label='Avg dist abs')
+    t['d6'], = host.plot([], [], ls='-', lw=4, c='r', alpha=0.3, label='Speed roll_mean_10')
+    t['d7'], = par1.plot([], [], ls='-', lw=4, c='g', alpha=0.3, label='Dist roll_mean_10')
+    t['d8'], = par2.plot([], [], ls='-', lw=4, c='b', alpha=0.3, label='Time roll_mean_10')
+
+    time_line_formats = {'xmin':0, 'xmax': 1, 'ls':'dashed', 'lw':1, 'alpha':0.3, 'c': 'b'}
+    for quarter_hour in range(30, 195, 15):
+        par2.axhline(y=quarter_hour, **time_line_formats, label=f'{quarter_hour}min')
+
+    t['pb_speed'], = host.plot([], [], marker='*', c='r', markersize=15)
+    t['pb_distance'], = par1.plot([], [], marker='*', c='g', markersize=15)
+
+    host.set_xlabel("Date", fontsize=12, c='k')
+    host.set_ylabel("avg speed [km/h]", fontsize=12, c='r')
+    par1.set_ylabel("Distance [km]", fontsize=12, c='g')
+    par2.set_ylabel("Run time [min]", fontsize=12, c='b')
+    tkw = {'size':4, 'width':1.5}
+    host.tick_params(axis='y', colors='r', **tkw)
+    par1.tick_params(axis='y', colors='g', **tkw)
+    par2.tick_params(axis='y', colors='b', **tkw)
+    host.tick_params(axis='x', **tkw)
+
+    data = [t[d] for d in ('d1', 'd4', 'd6', 'd2', 'd5', 'd7', 'd3', 'd8')]
+    host.legend(data, [d.get_label() for d in data], loc=2, fontsize=12, bbox_to_anchor=(1.1, 0, 1., 1.))
+    props = dict(boxstyle='round', facecolor='white', alpha=0.7)
+    t['text'] = host.text(1.11, 0.45, '', transform=host.transAxes, fontsize=10,
+                          verticalalignment='top', bbox=props)
+    t['title'] = host.set_title('', fontsize=14)
+    fig.tight_layout(pad=5)
+    return t
+
+
+def update_template(t, df, textstr, avg_speed, avg_distance, start_plot, end_plot,
+                    max_points=LOD_POINTS, method='lttb'):
+    """Same figure as `runlog.make_plot`, only updating the data of a template"""
+    host, par1, par2 = t['host'], t['par1'], t['par2']
+    x = mdates.date2num(df.index.to_pydatetime())
+    lod = max_points is not None and df.shape[0] > max_points
+    style = '-' if df.shape[0] > SMALL_DF else 'o-'
+    for d, col in (('d1', 'avg_speed'), ('d2', 'Distance'), ('d6', 'Speed_rolling_mean'),
+                   ('d7', 'Distance_rolling_mean'), ('d8', 'Runtime_rolling_mean')):
+        if lod:
+            s = decimate.decimate_series(df[col], max_points, method)
+            t[d].set_data(mdates.date2num(s.index.to_pydatetime()), s.to_numpy())
+        else:
+            t[d].set_data(x, df[col].to_numpy())
+    for d in ('d1', 'd2'):
+        t[d].set_marker('o' if style == 'o-' else 'None')
+
+    # run time bars as one polygon collection
+    if lod:
+        bar_x, h, width = decimate.bin_runtime(df['total_time'])
+        bar_x = mdates.date2num(bar_x.to_pydatetime())
+    else:
+        bar_x, h, width = x, df['total_time'].to_numpy(), BAR_WIDTH
+    left, right = bar_x - width / 2, bar_x + width / 2
+    verts = np.stack([np.column_stack([left, np.zeros_like(h)]),
+                      np.column_stack([left, h]),
+                      np.column_stack([right, h]),
+                      np.column_stack([right, np.zeros_like(h)])], axis=1)
+    t['d3'].set_verts(verts)
+
+    t['d4'].set_ydata([avg_speed, avg_speed])
+    t['d5'].set_ydata([avg_distance, avg_distance])
+
+    i_speed = int(np.argmax(df['avg_speed'].to_numpy()))
+    i_dist = int(np.argmax(df['Distance'].to_numpy()))
+    t['pb_speed'].set_data([x[i_speed]], [df['avg_speed'].iloc[i_speed]])
+    t['pb_distance'].set_data([x[i_dist]], [df['Distance'].iloc[i_dist]])
+
+    try:
+        start_plot = start_plot.date()
+    except AttributeError:
+        start_plot = start_plot
+    try:
+        end_plot = end_plot.date()
+    except AttributeError:
+        end_plot = end_plot
+    t['title'].set_text(f"Rob's run log from {start_plot} to {end_plot}")
+    t['text'].set_text(textstr)
+
+    host.set_xlim(x[0] - BAR_WIDTH, x[-1] + BAR_WIDTH)
+    if df.shape[0] <= SMALL_DF:
+        host.set_xticks(ticks=x)
+        host.set_xticklabels(df.index.date, rotation=90, fontsize=10)
+    else:
+        locator = mdates.AutoDateLocator()
+        host.xaxis.set_major_locator(locator)
+        host.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+        plt.setp(host.get_xticklabels(), rotation=0, fontsize=10)
+
+    max_speed = df['avg_speed'].max()
+    max_dist = df['Distance'].max()
+    max_yscale = max_speed if max_speed > max_dist else max_dist
+    host.set_ylim(MIN_SPEED, int(math.ceil(max_yscale)))
+    par1.set_ylim(MIN_DIST, int(math.ceil(max_yscale)))
+    max_time = df['total_time'].max()
+    par2.set_ylim(MIN_TIME, int(math.ceil(max_time / 5.)) * 5)
+    host.set_yticks(np.arange(math.floor(MIN_SPEED), math.ceil(max_yscale) + 1, 1.0))
+    par1.set_yticks(np.arange(math.floor(MIN_DIST), math.ceil(max_yscale) + 1, 1.0))
+    par2.set_yticks(np.arange(math.floor(MIN_TIME), math.ceil(max_time) + 5, 5))
+    return t
+
+
+def make_hist_template():
+    """Build the `runhist.make_hist` figure once with empty artists
+    Returns:
+        template: dict of the figure, axes and artists to update
+    """
+    fig, ax = plt.subplots(figsize=(20, 10))
+    t = {'fig': fig, 'ax': ax}
+    t['bars'] = PolyCollection([], alpha=0.5, edgecolor='k', facecolor='C0', label='Distance')
+    ax.add_collection(t['bars'], autolim=False)
+    t['kde'], = ax.plot([], [], c='C0', lw=1.5)
+    text_y = ax.get_xaxis_transform()
+    t['rug'] = LineCollection([], transform=text_y, color='C0', lw=1)
+    ax.add_collection(t['rug'], autolim=False)
+    for key, c, ls, label in (('perc25', 'r', '-', '25 percentile'), ('median', 'g', '--', 'median'),
+                              ('mean', 'b', '-.', 'mean'), ('perc75', 'k', ':', '75 percentile')):
+        t[key] = ax.axvline(0, color=c, linestyle=ls, lw=1.5, label=label)
+        t[key + '_text'] = ax.text(0, 0.95, '', transform=text_y)
+    t['title'] = ax.set_title('', fontsize=14)
+    ax.set_xlabel('Distance [km]')
+    ax.set_ylabel('Probability')
+    ax.grid(c='k', alpha=0.2)
+    ax.legend()
+    return t
+
+
+def update_hist_template(t, df, start_plot, end_plot):
+    """Same figure as `runhist.make_hist`, only updating the data of a template"""
+    ax = t['ax']
+    h = histkde.hist_from_values(df.Distance.to_numpy())
+    dist_min, dist_max = np.floor(h['min']), np.ceil(h['max'])
+    bins = np.arange(dist_min-1, dist_max+1, 1)
+    prob = histkde.rebin(h, bins) / h['n']
+    left, right = bins[:-1], bins[:-1] + 1
+    verts = np.stack([np.column_stack([left, np.zeros_like(prob)]),
+                      np.column_stack([left, prob]),
+                      np.column_stack([right, prob]),
+                      np.column_stack([right, np.zeros_like(prob)])], axis=1)
+    t['bars'].set_verts(verts)
+    x, density = histkde.kde(h) if h['n'] > 1 else ([], [])
+    t['kde'].set_data(x, density)
+    rug = np.flatnonzero(h['counts']) * h['resolution']
+    t['rug'].set_segments([[(r, 0), (r, 0.025)] for r in rug])
+
+    perc25, median, perc75 = histkde.quantile(h, [0.25, 0.5, 0.75])
+    for key, value in (('perc25', perc25), ('median', median), ('mean', histkde.mean(h)), ('perc75', perc75)):
+        t[key].set_xdata([value, value])
+        t[key + '_text'].set_x(value)
+        t[key + '_text'].set_text(f' {value:.1f}km')
+
+    try:
+        start_plot = start_plot.date()
+    except AttributeError:
+        start_plot = start_plot
+    try:
+        end_plot = end_plot.date()
+    except AttributeError:
+        end_plot = end_plot
+    t['title'].set_text(f"Rob's run distribution from {start_plot} to {end_plot}")
+
+    # the limits the bars and the KDE would have autoscaled to
+    lo, hi = np.min(x, initial=bins[0]), np.max(x, initial=bins[-1])
+    pad = 0.05 * (hi - lo)
+    ax.set_xlim(lo - pad, hi + pad)
+    ax.set_xticks(bins)
+    ax.set_ylim(0, 1.05 * max(prob.max(), np.max(density, initial=0)))
+    return t
+
+
+def render_job(job):
+    """Render one report figure in a worker process
+    Args:
+        job: dict with keys
+            runlog: runlog CSV or `runstore` directory
+            out: output file, the extension picks the format (png, svg, ...)
+            kind: 'plot' (default) or 'hist'
+            start, end: optional date range
+    Returns:
+        out, or None when the figure could not be made, the batch then exits non-zero
+    """
+    try:
+        return _render_job(job)
+    except Exception as e:
+        # one bad runlog must not stop the rest of the nightly run, it fails it at the end
+        print(f'Failed {job["out"]}: {type(e).__name__}: {e}', file=sys.stderr)
+        return None
+
+
+def _render_job(job):
+    df = load_runlog(job['runlog'])
+    start_plot = job.get('start') or df.index[0]
+    end_plot = job.get('end') or df.index[-1]
+    df = df.iloc[timeindex.window(timeindex.build_time_index(df.index), start_plot, end_plot)]
+    kind = job.get('kind', 'plot')
+    if kind not in _TEMPLATES:
+        _TEMPLATES[kind] = make_hist_template() if kind == 'hist' else make_template()
+    t = _TEMPLATES[kind]
+    if kind == 'hist':
+        update_hist_template(t, df, start_plot, end_plot)
+    else:
+        textstr, avg_speed, avg_distance = calculate_stats(df)
+        update_template(t, df, textstr, avg_speed, avg_distance, start_plot, end_plot)
+    t['fig'].savefig(job['out'])
+    return job['out']
+
+
+def render_all(jobs, processes=None, chunksize=4):
+    """Render many report figures in parallel
+    Args:
+        jobs: list of job dicts, see `render_job`
+        processes: number of worker processes, defaults to the CPU count
+        chunksize: jobs handed to a worker at a time
+    Returns:
+        list of written files in job order, None for skipped jobs
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(render_job, jobs, chunksize=chunksize))
+
+
+def make_jobs(pattern, outdir, start=None, end=None, fmt='png'):
+    """One plot and one histogram job per athlete runlog found with `runbatch.find_runlogs`"""
+    os.makedirs(outdir, exist_ok=True)
+    jobs = []
+    for athlete, path in find_runlogs(pattern).items():
+        for kind in ('plot', 'hist'):
+            jobs.append({'runlog': path, 'kind': kind, 'start': start, 'end': end,
+                         'out': os.path.join(outdir, f'{athlete}_{kind}.{fmt}')})
+    return jobs
+
+
+if __name__ == '__main__':
+    try:
+        pattern, outdir = sys.argv[1], sys.argv[2]
+    except IndexError:
+        raise IndexError('usage: runreport.py <runlog dir or glob> <output dir> [start] [end]')
+    start = sys.argv[3] if len(sys.argv) > 3 else None
+    end = sys.argv[4] if len(sys.argv) > 4 else None
+    jobs = make_jobs(pattern, outdir, start, end)
+    written = [out for out in render_all(jobs) if out]
+    print(f'{len(written)} figures written to {outdir}')
+    if len(written) < len(jobs):
+        sys.exit(f'{len(jobs) - len(written)} of {len(jobs)} figures failed')
@@ -0,0 +1,229 @@
+import os
+import csv
+import json
+import math
+from collections import deque
+from datetime import date
+
+WINDOW = 10
+
+
+def sidecar(fname):
+    """Return the path of the running-stats file kept next to a runlog"""
+    return fname + '.stats.json'
+
+
+def new_state():
+    """Make an empty running-aggregate state
+    Returns:
+        state: dict of running aggregates, JSON serialisable once saved
+    """
+    return {'count': 0,
+            'first_date': None,
+            'last_date': None,
+            'prev_date': None,
+            'total_distance': 0.,
+            'pb_distance': None,
+            'pb_speed': None,
+            'last_distance': None,
+            'last_speed': None,
+            # Welford accumulators [n, mean, M2]
+            'distance_welford': [0, 0., 0.],
+            'speed_welford': [0, 0., 0.],
+            # ring buffers for the rolling means
+            'distance_window': deque(maxlen=WINDOW),
+            'speed_window': deque(maxlen=WINDOW),
+            'runtime_window': deque(maxlen=WINDOW),
+            'size': 0,
+            }
+
+
+def _welford(acc, x):
+    """Update a Welford accumulator `[n, mean, M2]` in place"""
+    acc[0] += 1
+    delta = x - acc[1]
+    acc[1] += delta / acc[0]
+    acc[2] += delta * (x - acc[1])
+
+
+def parse_timedate(timedate):
+    """Split a runlog DateTime into run date and run time
+    Args:
+        timedate: runlog DateTime in form `'YYYY-MM-DD HH:MM:SS'`
+    Returns:
+        run_date [datetime.date], total_time [float] in minutes
+    """
+    day, hms = timedate.strip().split(' ')
+    h, m, s = (int(v) for v in hms.split(':'))
+    return date.fromisoformat(day), h * 60 + m + s / 60
+
+
+def update_state(state, timedate, distance):
+    """Add one run to the state in O(1)
+    Args:
+        state: dict from `new_state` or `load_state`
+        timedate: runlog DateTime in form `'YYYY-MM-DD HH:MM:SS'`
+        distance: run distance in km, [float]
+    Returns:
+        state
+    """
+    run_date, total_time = parse_timedate(timedate)
+    distance = float(distance)
+    speed = distance / total_time * 60
+
+    state['count'] += 1
+    state['total_distance'] += distance
+    if state['first_date'] is None:
+        state['first_date'] = run_date.isoformat()
+    state['prev_date'] = state['last_date']
+    state['last_date'] = run_date.isoformat()
+    if state['pb_distance'] is None or distance > state['pb_distance']:
+        state['pb_distance'] = distance
+    if state['pb_speed'] is None or speed > state['pb_speed']:
+        state['pb_speed'] = speed
+    state['last_distance'] = distance
+    state['last_speed'] = speed
+    _welford(state['distance_welford'], distance)
+    _welford(state['speed_welford'], speed)
+    state['distance_window'].append(distance)
+    state['speed_window'].append(speed)
+    state['runtime_window'].append(total_time)
+    return state
+
+
+def rolling_mean(state, key):
+    """Mean of the last `WINDOW` runs, NaN until the window is full like `df.rolling(10)`"""
+    window = state[f'{key}_window']
+    if len(window) < WINDOW:
+        return float('nan')
+    return sum(window) / WINDOW
+
+
+def std(state, key):
+    """Sample standard deviation from a Welford accumulator"""
+    n, _, m2 = state[f'{key}_welford']
+    return math.sqrt(m2 / (n - 1)) if n > 1 else float('nan')
+
+
+def state_from_csv(fname):
+    """Build the state with a single pass over an existing runlog CSV"""
+    state = new_state()
+    with open(fname, newline='') as f:
+        for row in csv.DictReader(f):
+            update_state(state, row['DateTime'], row['Distance'])
+    state['size'] = os.path.getsize(fname)
+    return state
+
+
+def save_state(state, fname):
+    """Atomically write the state next to the runlog `fname`"""
+    out = dict(state)
+    for key in ('distance_window', 'speed_window', 'runtime_window'):
+        out[key] = list(state[key])
+    tmp = sidecar(fname) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(out, f)
+    os.replace(tmp, sidecar(fname))
+
+
+def load_state(fname):
+    """Load the running stats for runlog `fname`
+    The state is rebuilt from the CSV when the sidecar is missing or
+    the runlog was changed by something other than `append_run`.
+    Args:
+        fname: path to runlog CSV, [str]
+    Returns:
+        state
+    """
+    try:
+        with open(sidecar(fname)) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = None
+    if state is None or state['size'] != os.path.getsize(fname):
+        state = state_from_csv(fname)
+        save_state(state, fname)
+        return state
+    for key in ('distance_window', 'speed_window', 'runtime_window'):
+        state[key] = deque(state[key], maxlen=WINDOW)
+    return state
+
+
+def append_run(fname, timedate, distance):
+    """Update the running stats after a run was appended to runlog `fname`
+    Args:
+        fname: path to runlog CSV, [str]
+        timedate: runlog DateTime in form `'YYYY-MM-DD HH:MM:SS'`
+        distance: run distance in km
+    Returns:
+        state
+    """
+    return append_runs(fname, [(timedate, distance)])
+
+
+def append_runs(fname, rows):
+    """Update the running stats after several runs were appended to runlog `fname`
+    Args:
+        fname: path to runlog CSV, [str]
+        rows: list of `(timedate, distance)` in the order they were appended
+    Returns:
+        state
+    """
+    added_size = sum(len(f'{timedate},{distance}\n'.encode()) for timedate, distance in rows)
+    try:
+        with open(sidecar(fname)) as f:
+            state = json.load(f)
+        for key in ('distance_window', 'speed_window', 'runtime_window'):
+            state[key] = deque(state[key], maxlen=WINDOW)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = None
+    if state is None or state['size'] + added_size != os.path.getsize(fname):
+        # sidecar is out of step with the runlog, rebuild it
+        state = state_from_csv(fname)
+    else:
+        for timedate, distance in rows:
+            update_state(state, timedate, distance)
+        state['size'] += added_size
+    save_state(state, fname)
+    return state
+
+
+def make_textstr(run_count, weeks, mean_dist, mean_speed, pb_dist, pb_speed,
+                 total_dist, last_dist, last_speed):
+    """Format the stats panel shown by `runlog.make_plot`"""
+    title1 = r"$\bf{Period\ stats:}$"
+    title2 = r"$\bf{Last\ run:}$"
+    textstr = f'''
+    {title1}
+    ---------------------
+    run_count: {run_count}
+    run_freq: {run_count / max(weeks, 1):.1f} runs/week
+    mean_dist: {mean_dist:.2f} km
+    mean_speed: {mean_speed:.2f} km/hr
+    PB distance: {pb_dist} km
+    PB speed: {pb_speed:.2f} km/hr
+    Total distance: {total_dist:.2f} km
+
+    {title2}
+    ---------------
+    distance: {last_dist}km
+    speed: {last_speed:.2f}km/hr
+    '''
+    return textstr
+
+
+def calculate_stats(state):
+    """Stats panel and PB checks from the running state, same returns as `runlog.calculate_stats`"""
+    weeks = (date.fromisoformat(state['last_date']) - date.fromisoformat(state['first_date'])).days // 7
+    avg_distance = state['distance_welford'][1]
+    avg_speed = state['speed_welford'][1]
+    textstr = make_textstr(state['count'], weeks, avg_distance, avg_speed,
+                           state['pb_distance'], state['pb_speed'], state['total_distance'],
+                           state['last_distance'], state['last_speed'])
+
+    if state['pb_distance'] == state['last_distance']:
+        print(f'New PB distance! {state["pb_distance"]:.2f}km')
+    if state['pb_speed'] == state['last_speed']:
+        print(f'New PB speed! {state["pb_speed"]:.2f}km/hr')
+
+    return textstr, avg_speed, avg_distance
@@ -0,0 +1,133 @@
+"""Append-only columnar binary store for the runlog.
+
+A store is a directory holding one little-endian file per column:
+
+    ts.i8     int64   run date as epoch seconds
+    dist.f4   float32 distance [km]
+    dur.f4    float32 run time [min]
+    gear.u1   uint8   gear code, see `GEAR_CODES`
+
+Appending only uses the standard library so `addrun` stays light,
+reading memory-maps each column so `runlog`/`runhist` get NumPy views
+without parsing. `runlog` copies the distances once on load, widened to
+float64 and rounded back to the log's 2 decimals.
+"""
+import os
+import sys
+import struct
+from datetime import datetime, date
+
+COLUMNS = {'ts': ('ts.i8', '<q', '<i8'),
+           'dist': ('dist.f4', '<f', '<f4'),
+           'dur': ('dur.f4', '<f', '<f4'),
+           'gear': ('gear.u1', '<B', 'u1'),
+           }
+GEAR_CODES = {'': 0, 'kw': 1, 'kb': 2, 'p': 3, 't': 4, 'b': 5}
+EPOCH = date(1970, 1, 1)
+
+
+def _split_timedate(timedate):
+    """Return (epoch seconds of the run date, run time in minutes) for `'YYYY-MM-DD HH:MM:SS'`"""
+    dt = datetime.strptime(timedate.strip(), '%Y-%m-%d %H:%M:%S')
+    ts = (dt.date() - EPOCH).days * 86400
+    return ts, dt.hour * 60 + dt.minute + dt.second / 60
+
+
+def column_paths(path):
+    """Paths of the column files of a store"""
+    return [os.path.join(path, fname) for fname, _, _ in COLUMNS.values()]
+
+
+def append_runs(path, rows):
+    """Append runs to a store, creating it if needed
+    Args:
+        path: store directory, [str]
+        rows: iterable of `(timedate, distance, gear)` with timedate
+              in form `'YYYY-MM-DD HH:MM:SS'` and gear a key of `GEAR_CODES`
+    Returns:
+        number of rows appended
+    """
+    buffers = {col: bytearray() for col in COLUMNS}
+    n = 0
+    for timedate, distance, gear in rows:
+        ts, dur = _split_timedate(timedate)
+        buffers['ts'] += struct.pack(COLUMNS['ts'][1], ts)
+        buffers['dist'] += struct.pack(COLUMNS['dist'][1], float(distance))
+        buffers['dur'] += struct.pack(COLUMNS['dur'][1], dur)
+        buffers['gear'] += struct.pack(COLUMNS['gear'][1], GEAR_CODES.get(gear or '', 0))
+        n += 1
+    os.makedirs(path, exist_ok=True)
+    # the timestamp column is written last so readers never see a
+    # timestamp without its values, see `open_store`
+    for col in ('dist', 'dur', 'gear', 'ts'):
+        with open(os.path.join(path, COLUMNS[col][0]), 'ab') as f:
+            f.write(buffers[col])
+    return n
+
+
+def append_run(path, newrun):
+    """Append one run in addrun form `'YYYY-MM-DD,HH:MM:SS,KK.MM,[gear]'`"""
+    fields = newrun.split(',')
+    gear = fields[3] if len(fields) > 3 else ''
+    return append_runs(path, [(' '.join(fields[:2]), fields[2], gear)])
+
+
+def open_store(path):
+    """Memory-map a store
+    Args:
+        path: store directory, [str]
+    Returns:
+        dict of read-only NumPy views, one per column, all the same length
+    """
+    import numpy as np
+
+    cols = {}
+    for col, (fname, _, dtype) in COLUMNS.items():
+        fpath = os.path.join(path, fname)
+        if os.path.getsize(fpath) == 0:
+            cols[col] = np.empty(0, dtype=dtype)
+        else:
+            cols[col] = np.memmap(fpath, dtype=dtype, mode='r')
+    # a half-finished append can leave some columns longer than others
+    n = min(len(v) for v in cols.values())
+    return {col: v[:n] for col, v in cols.items()}
+
+
+def run_index(cols):
+    """Rebuild the runlog DateTime values (run date plus run time) as datetime64[s]"""
+    import numpy as np
+
+    seconds = cols['ts'] + np.rint(cols['dur'].astype('f8') * 60).astype('i8')
+    return seconds.astype('datetime64[s]')
+
+
+def csv_to_store(fname, path):
+    """One-shot conversion of a runlog CSV into a store
+    Args:
+        fname: runlog CSV with `DateTime,Distance` columns, [str]
+        path: store directory to create, [str]
+    Returns:
+        number of rows written
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(fname)
+    dt = pd.to_datetime(df['DateTime'])
+    day = dt.dt.normalize()
+    ts = (day - pd.Timestamp(EPOCH)).dt.days.to_numpy('i8') * 86400
+    dur = (dt - day).dt.total_seconds().to_numpy() / 60
+    columns = {'ts': ts,
+               'dist': df['Distance'].to_numpy(),
+               'dur': dur,
+               'gear': np.zeros(len(df)),
+               }
+    os.makedirs(path, exist_ok=True)
+    for col, (fname_col, _, dtype) in COLUMNS.items():
+        columns[col].astype(dtype).tofile(os.path.join(path, fname_col))
+    return len(df)
+
+
+if __name__ == '__main__':
+    n = csv_to_store(sys.argv[1], sys.argv[2])
+    print(f'{n} runs written to {sys.argv[2]}')
@@ -0,0 +1,73 @@
+import os
+import sys
+import random
+import tempfile
+from multiprocessing import Pool
+
+import addrun
+
+
+def make_runs(n):
+    """n distinct runs with gear, spread over the last few years"""
+    rng = random.Random(0)
+    runs = set()
+    while len(runs) < n:
+        day = f'20{rng.randint(18, 23)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+        runs.add(f'{day},00:{rng.randint(20, 59):02d}:{rng.randint(0, 59):02d},'
+                 f'{rng.randint(3, 20)}.{rng.randint(0, 99):02d},{rng.choice(addrun.RUNLOG_GEAR)}')
+    return sorted(runs)
+
+
+def writer(args):
+    """One device: sync its share of runs in small batches, some of them twice"""
+    path, path_gear, runs, seed = args
+    rng = random.Random(seed)
+    sys.stdout = open(os.devnull, 'w')
+    batches, i = [], 0
+    while i < len(runs):
+        size = rng.randint(1, 5)
+        batches.append(runs[i:i + size])
+        i += size
+    # every device also re-sends a few batches another device already has
+    batches += rng.sample(batches, k=min(3, len(batches)))
+    for batch in batches:
+        addrun.ingest(path, path_gear, batch)
+    return len(batches)
+
+
+def stress(n_writers=16, n_runs=2000):
+    """Spawn `n_writers` processes writing overlapping runs, then check nothing was lost or counted twice"""
+    runs = make_runs(n_runs)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'runlog')
+        path_gear = os.path.join(tmp, 'gear_mileage.csv')
+        with open(path, 'w') as f:
+            f.write('DateTime,Distance\n')
+        with open(path_gear, 'w') as f:
+            f.write(','.join(addrun.GEAR_COLUMNS.values()) + '\n')
+            f.write(','.join('0.0' for _ in addrun.GEAR_COLUMNS) + '\n')
+
+        # each writer gets an overlapping slice so the same run arrives from several devices
+        share = 2 * n_runs // n_writers
+        jobs = [(path, path_gear, runs[(i * n_runs // n_writers):(i * n_runs // n_writers) + share], i)
+                for i in range(n_writers)]
+        with Pool(n_writers) as pool:
+            pool.map(writer, jobs)
+
+        with open(path) as f:
+            logged = f.read().splitlines()[1:]
+        expected = {}
+        for run in runs:
+            gear, kms = run.split(',')[-1], float(run.split(',')[-2])
+            col = addrun.GEAR_COLUMNS[gear]
+            expected[col] = expected.get(col, 0.) + kms
+        mileage = addrun.read_gear_mileage(path_gear)
+
+        assert len(logged) == len(set(logged)) == n_runs, f'{len(logged)} runs logged, expected {n_runs}'
+        for col, km in expected.items():
+            assert abs(mileage[col] - km) < 0.01, f'{col}: {mileage[col]} != {km:.2f}'
+        print(f'OK: {n_writers} writers, {n_runs} runs, {len(logged)} logged once each, mileage matches')
+
+
+if __name__ == '__main__':
+    stress(*(int(v) for v in sys.argv[1:3]))
@@ -0,0 +1,100 @@
+import numpy as np
+
+DAY_NS = 86400 * 10**9
+WEEK_NS = 7 * DAY_NS
+
+
+def build_time_index(index):
+    """Build a sorted time index with per-day and per-ISO-week offset tables
+    Args:
+        index: sorted datetime-like values, e.g. `df.index` of a runlog df
+    Returns:
+        tidx: dict with
+            ns: int64 nanoseconds since epoch
+            day_keys, day_offsets: distinct days since epoch and the position of
+                                   their first run, `day_offsets[-1] == len(ns)`
+            week_keys, week_offsets: same for ISO weeks (Monday based) since epoch
+    """
+    ns = np.asarray(index, dtype='datetime64[ns]').astype('i8')
+    if ns.size and (np.diff(ns) < 0).any():
+        raise ValueError('time index values must be sorted')
+    days = ns // DAY_NS
+    # 1970-01-01 was a Thursday, shift by 3 days so weeks start on Monday
+    weeks = (days + 3) // 7
+    day_keys, day_offsets = np.unique(days, return_index=True)
+    week_keys, week_offsets = np.unique(weeks, return_index=True)
+    return {'ns': ns,
+            'day_keys': day_keys,
+            'day_offsets': np.append(day_offsets, ns.size),
+            'week_keys': week_keys,
+            'week_offsets': np.append(week_offsets, ns.size),
+            }
+
+
+def _to_datetime64(value):
+    """Convert a str, date, datetime or pandas Timestamp to `np.datetime64` keeping its resolution"""
+    if isinstance(value, str):
+        return np.datetime64(value.strip().replace(' ', 'T'))
+    return np.datetime64(value)
+
+
+def _day(value):
+    return value.astype('datetime64[D]').astype('i8')
+
+
+def window(tidx, start=None, end=None):
+    """Positional slice for a date window, like `df[start:end]` on a DatetimeIndex
+    Day, month or year bounds (`'2020-05-01'`, `date(2020, 5, 1)`, `'2020-05'`) cover
+    whole periods and are looked up in the day table, bounds with a time of day
+    are matched exactly.
+    Args:
+        tidx: dict from `build_time_index`
+        start, end: window bounds, None for open ended
+    Returns:
+        slice to use with `df.iloc`
+    """
+    keys, offsets = tidx['day_keys'], tidx['day_offsets']
+    lo, hi = 0, tidx['ns'].size
+    if start is not None:
+        start = _to_datetime64(start)
+        if np.datetime_data(start.dtype)[0] in ('Y', 'M', 'W', 'D'):
+            lo = offsets[np.searchsorted(keys, _day(start), side='left')]
+        else:
+            lo = np.searchsorted(tidx['ns'], start.astype('datetime64[ns]').astype('i8'), side='left')
+    if end is not None:
+        end = _to_datetime64(end)
+        if np.datetime_data(end.dtype)[0] in ('Y', 'M', 'W', 'D'):
+            # last day of the period
+            last_day = _day(end + 1) - 1
+            hi = offsets[np.searchsorted(keys, last_day, side='right')]
+        else:
+            hi = np.searchsorted(tidx['ns'], end.astype('datetime64[ns]').astype('i8'), side='right')
+    return slice(int(lo), int(max(lo, hi)))
+
+
+def previous_week(tidx, i=-1):
+    """Slice of runs from 8 days to 1 day before run `i`, both ends included"""
+    ns = tidx['ns']
+    t = ns[i]
+    lo = np.searchsorted(ns, t - 8 * DAY_NS, side='left')
+    hi = np.searchsorted(ns, t - DAY_NS, side='right')
+    return slice(int(lo), int(hi))
+
+
+def week_slice(tidx, week_key):
+    """Slice of runs in the ISO week `week_key` (weeks since epoch, Monday based)"""
+    j = np.searchsorted(tidx['week_keys'], week_key)
+    if j == tidx['week_keys'].size or tidx['week_keys'][j] != week_key:
+        return slice(0, 0)
+    return slice(int(tidx['week_offsets'][j]), int(tidx['week_offsets'][j + 1]))
+
+
+def runs_per_week(tidx):
+    """Week keys and number of runs in each week that has runs"""
+    return tidx['week_keys'], np.diff(tidx['week_offsets'])
+
+
+def days_since_last_run(tidx):
+    """Whole days between the last two runs"""
+    ns = tidx['ns']
+    return int((ns[-1] - ns[-2]) // DAY_NS)